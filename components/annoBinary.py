@@ -0,0 +1,88 @@
+import numpy as np
+import struct
+import json
+
+'''
+binary annotation container:
+    magic (8 bytes), header length (uint32), number of coordinate pairs (uint32),
+    json header padded to a multiple of 4 bytes,
+    all coordinates packed into one little-endian int32 buffer of shape (N, 2)
+the header holds status, labels and one entry per annotation without its coordinates,
+'_offset' and '_count' locate the coordinates in the buffer,
+'_point' marks a single coordinate pair [x, y] (dots and ellipse centers)
+'''
+
+MAGIC = b'IMANNB01'
+PREFIX = struct.Struct('<8sII')
+
+def _pack(anno_file):
+    entries, chunks, offset = [], [], 0
+    for timestamp, item in anno_file['annotations'].items():
+        entry = {k: v for k, v in item.items() if k != 'coords'}
+        entry['timestamp'] = timestamp
+        if 'coords' in item:
+            coords = np.asarray(item['coords'], dtype='<i4')
+            # a single coordinate pair, not an empty list
+            entry['_point'] = coords.ndim == 1 and coords.size == 2
+            coords = coords.reshape((-1, 2))
+            entry['_offset'], entry['_count'] = offset, len(coords)
+            offset += len(coords)
+            chunks.append(coords)
+        entries.append(entry)
+    header = {'status': anno_file['status'], 'labels': anno_file['labels'], 'annotations': entries}
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * (-(PREFIX.size + len(header)) % 4)
+    coords = np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0, 2), dtype='<i4')
+    return header, coords
+
+def write_binary(anno_file, f):
+    '''
+    Args:
+        anno_file: {'status': ..., 'labels': ..., 'annotations': {timestamp: annotation}}
+        f: file object opened in binary mode
+    '''
+    header, coords = _pack(anno_file)
+    f.write(PREFIX.pack(MAGIC, len(header), len(coords)))
+    f.write(header)
+    f.write(coords.astype('<i4', copy=False).tobytes())
+
+def save_binary(anno_file, path):
+    with open(path, 'wb') as f:
+        write_binary(anno_file, f)
+
+def _read_header(buf):
+    magic, header_len, n = PREFIX.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError('not an annotation container')
+    header = json.loads(bytes(buf[PREFIX.size:PREFIX.size+header_len]).decode('utf-8'))
+    return header, PREFIX.size + header_len, n
+
+def read_binary_header(path):
+    '''
+    read status, labels and annotation entries without the coordinates
+    '''
+    with open(path, 'rb') as f:
+        prefix = f.read(PREFIX.size)
+        _, header_len, _ = PREFIX.unpack(prefix)
+        header, _, _ = _read_header(prefix + f.read(header_len))
+    return header
+
+def read_binary(path, as_list=False):
+    '''
+    Args:
+        as_list: convert coordinates to nested lists (as in json files),
+            otherwise they are numpy views into one buffer, without copies
+    Return: {'status': ..., 'labels': ..., 'annotations': {timestamp: annotation}}
+    '''
+    with open(path, 'rb') as f:
+        buf = f.read()
+    header, start, n = _read_header(buf)
+    coords = np.frombuffer(buf, dtype='<i4', count=2*n, offset=start).reshape((n, 2))
+    annotations = {}
+    for entry in header['annotations']:
+        if '_offset' in entry:
+            offset, count, point = entry.pop('_offset'), entry.pop('_count'), entry.pop('_point')
+            c = coords[offset] if point else coords[offset:offset+count]
+            entry['coords'] = c.tolist() if as_list else c
+        annotations[entry['timestamp']] = entry
+    return {'status': header['status'], 'labels': header['labels'], 'annotations': annotations}
@@ -0,0 +1,153 @@
+import threading
+import os
+
+from .enumDef import *
+from .func_annotation import anno_read
+from .annoBinary import read_binary_header
+from .messages import ProgressDiag
+
+def summarize(anno_file):
+    '''
+    Args:
+        anno_file: {'status': ..., 'labels': ..., 'annotations': {timestamp: annotation}}
+    Return: {'status': ..., 'count': number of objects, 'labels': {property: {label: count}},
+             'types': {type: count}, 'props': {property: [defined labels]}}
+    '''
+    labels, types = {}, {}
+    for anno in anno_file['annotations'].values():
+        types[anno['type']] = types.get(anno['type'], 0) + 1
+        for prop, label in anno.get('labels', {}).items():
+            stats = labels.setdefault(prop, {})
+            stats[label] = stats.get(label, 0) + 1
+    return {'status': anno_file['status'],
+            'count': len(anno_file['annotations']),
+            'labels': labels,
+            'types': types,
+            'props': {prop: list(lbs.keys()) for prop, lbs in anno_file['labels'].items()}}
+
+def _read_summary(path):
+    if os.path.splitext(path)[1] == BINARY_ANNOTATION_EXT:
+        # the coordinates are not needed
+        header = read_binary_header(path)
+        header['annotations'] = {e['timestamp']: e for e in header['annotations']}
+        return summarize(header)
+    anno = anno_read(path)
+    return summarize(anno) if anno is not None else None
+
+def _key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class SummaryCache(object):
+
+    """
+    summaries of annotation files keyed by path, an entry is valid while the file has the same (size, mtime_ns),
+    thread safe, the open project loads and persists the entries in its index
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = set()
+
+    def lookup(self, path):
+        '''
+        Return: the cached summary, None if there is no valid entry
+        '''
+        key = _key(path)
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(path))
+        return entry[1] if key is not None and entry is not None and entry[0] == key else None
+
+    def get(self, path):
+        '''
+        Return: the summary of the annotation file, None if the file does not exist
+        '''
+        key = _key(path)
+        if key is None:
+            return None
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        summary = _read_summary(path)
+        self.put(path, summary, key)
+        return summary
+
+    def put(self, path, summary, key=None):
+        '''
+        set the summary of a file just written
+        '''
+        key = _key(path) if key is None else key
+        if key is None or summary is None:
+            return
+        with self.lock:
+            self.entries[os.path.abspath(path)] = (key, summary)
+            self.changed.add(os.path.abspath(path))
+
+    def update(self, entries):
+        '''
+        Args:
+            entries: iterable of (path, size, mtime_ns, summary)
+        '''
+        with self.lock:
+            for path, size, mtime_ns, summary in entries:
+                self.entries[path] = ((size, mtime_ns), summary)
+
+    def take_changed(self):
+        '''
+        Return: entries set since the last call, as (path, size, mtime_ns, summary)
+        '''
+        with self.lock:
+            changed = [(path,) + self.entries[path][0] + (self.entries[path][1],) for path in self.changed]
+            self.changed.clear()
+        return changed
+
+SUMMARY_CACHE = SummaryCache()
+
+def get_summaries(anno_list):
+    '''
+    summaries of annotation files, a progress dialog is only shown for files not in the cache
+    Return: list of summaries (None for missing files)
+    '''
+    summaries = [SUMMARY_CACHE.lookup(p) for p in anno_list]
+    misses = [i for i, s in enumerate(summaries) if s is None]
+    if len(misses) > 0:
+        progress = ProgressDiag(len(misses), 'Counting...')
+        progress.show()
+        for i in misses:
+            summaries[i] = SUMMARY_CACHE.get(anno_list[i])
+            progress.new_item('Counted: ' + anno_list[i])
+    return summaries
+
+def summary_report(anno_list):
+    '''
+    Return: number of objects, {property: {label: count}}
+    '''
+    total, stats = 0, {}
+    for s in get_summaries(anno_list):
+        if s is None:
+            continue
+        total += s['count']
+        for prop, labels in s['labels'].items():
+            for label, count in labels.items():
+                stats.setdefault(prop, {})
+                stats[prop][label] = stats[prop].get(label, 0) + count
+    return total, stats
+
+def summary_props(anno_list):
+    '''
+    Return: {property: set of defined labels}
+    '''
+    props = {}
+    for s in get_summaries(anno_list):
+        if s is None:
+            continue
+        for prop, labels in s['props'].items():
+            props.setdefault(prop, set()).update(labels)
+    return props
@@ -78,7 +78,7 @@ class AnnotationDistributor(QDialog):
     def open_project(self):
         project_dialog = QFileDialog(self, "Select Project Directory")
         project_dialog.setLabelText(QFileDialog.Accept, 'Create/Open')
-        project_dialog.setNameFilter("*.improj")
+        project_dialog.setNameFilter("Project (*.imdb *.improj)")
         project_dialog.setLabelText(QFileDialog.FileName, 'Project Name')
 
         if project_dialog.exec_() == QFileDialog.Accepted:
@@ -1,14 +1,24 @@
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QPen, QBrush, QColor
 from PyQt5.QtWidgets import QGraphicsScene, QMessageBox  
+import threading
 import h5py
 import json
+import time
 import os
 
 from .base import Table
+from .spatialIndex import GridIndex
+from .saveQueue import SaveQueue, write_atomic
+from .annoBinary import read_binary, read_binary_header
+from .journal import Journal, journal_path, load_with_journal, read_ops
+from .annoSummary import summarize, SUMMARY_CACHE
 from .annotations import *
 from .canvas import Canvas
 
+# time budget (seconds) of one batch of graphics item insertion on the GUI thread
+LOAD_SLICE = 0.02
+
 class AnnotationManager(Table):
     def __init__(self, config, labelMgr, canvas=None):
         super().__init__()
@@ -20,15 +30,30 @@ class AnnotationManager(Table):
         self.status = UNFINISHED
         self.annotation_path = None
         self.index_graphItem = {}
+        # bounding boxes in scene coordinates, for picking and region queries
+        self.spatial = GridIndex()
+        # state of the chunked loader, None if not loading
+        self.loading = None
+        # called on the GUI thread once the labels of a chunked load are parsed
+        self.on_labels_loaded = None
+        # annotation files are written in the background
+        self.saver = SaveQueue()
+        # edits since the last snapshot, for crash recovery
+        self.journal = Journal()
+        # label edits go through the same counter, they also trigger compaction
+        self.labelMgr.record = self._journal
     
     def set_canvas(self, canvas):
         if isinstance(canvas, Canvas):
             self.canvas = canvas
 
     def clear(self):
+        self._stop_loading()
+        self.journal.close()
         if self.canvas is not None:
             self.canvas.clear()
         super().clear()
+        self.spatial.clear()
         self.labelMgr.clear()
 
     def get_annotation_by_graphItem(self, graphItem):
@@ -37,6 +62,41 @@ class AnnotationManager(Table):
         else:
             return None
 
+    ##########################
+    #### spatial queries  ####
+    ##########################
+
+    def update_index(self, anno):
+        '''
+        refresh the bounding box of an annotation, e.g. after the dot radius changed
+        '''
+        if anno.timestamp in self.keys():
+            r = anno.graphObject.sceneBoundingRect()
+            self.spatial.update(anno.timestamp, (r.left(), r.top(), r.right(), r.bottom()))
+
+    def annotations_at(self, pos):
+        '''
+        Args:
+            pos: QPointF in scene coordinates
+        Return: annotations whose shape contains pos, topmost first
+        '''
+        annos = []
+        for timestamp in self.spatial.query_point(pos.x(), pos.y()):
+            anno = self[timestamp]
+            item = anno.graphObject
+            if item.shape().contains(item.mapFromScene(pos)):
+                annos.append(anno)
+        return annos
+
+    def annotations_in_rect(self, rect):
+        '''
+        Args:
+            rect: QRectF in scene coordinates
+        Return: annotations whose bounding boxes intersect rect, topmost first
+        '''
+        timestamps = self.spatial.query_rect((rect.left(), rect.top(), rect.right(), rect.bottom()))
+        return [self[timestamp] for timestamp in timestamps]
+
     ##########################
     #### get / set status ####
     ##########################
@@ -46,15 +106,19 @@ class AnnotationManager(Table):
             if annotation_path is None:
                 self.status = status
             elif os.path.isfile(annotation_path):
-                with open(annotation_path, "r") as f:
-                    anno_file = json.load(f)
+                self.saver.flush(annotation_path)
+                if os.path.splitext(annotation_path)[1] == BINARY_ANNOTATION_EXT:
+                    anno_file = read_binary(annotation_path)
+                else:
+                    with open(annotation_path, "r") as f:
+                        anno_file = json.load(f)
                 anno_file['status'] = status
-                with open(annotation_path, "w") as f:
-                    json.dump(anno_file, f)
+                write_atomic(annotation_path, anno_file)
 
     def get_status(self, annotation_path=None):
         if annotation_path is None:
             return self.status
+        self.saver.flush(annotation_path)
         status = UNFINISHED
         if os.path.isfile(annotation_path):
             ext = os.path.splitext(annotation_path)[1]
@@ -68,6 +132,8 @@ class AnnotationManager(Table):
                     anno_file = json.load(f)
                     if 'status' in anno_file.keys():
                         status = anno_file['status']    
+            if ext == BINARY_ANNOTATION_EXT:
+                status = read_binary_header(annotation_path)['status']
         return status
 
 
@@ -96,6 +162,7 @@ class AnnotationManager(Table):
 
         self.add_annotation(anno)
         self.config.saved = False
+        self._journal({'op': 'add', 'timestamp': anno.timestamp, 'annotation': anno.render_save()})
     
     def add_annotation(self, anno, graphItem=True):
         self[anno.timestamp] = anno
@@ -103,43 +170,105 @@ class AnnotationManager(Table):
         if self.canvas is not None and graphItem:
             self.canvas.add_item(anno)
             anno.sync_disp(self.config)
+        self.update_index(anno)
+        if self.canvas is not None and graphItem:
+            self.canvas.overlay.add(anno)
     
     def remove_annotation(self, anno):
         if anno.timestamp in self.keys():
             if self.canvas is not None:
-                self.canvas.removeItem(anno.graphObject)
+                self.canvas.remove_item(anno)
+            self.spatial.remove(anno.timestamp)
             del self[anno.timestamp]
             del self.index_graphItem[anno.graphObject]
             self.config.saved = False
+            self._journal({'op': 'remove', 'timestamp': anno.timestamp})
         
     def remove_annotation_by_graphItem(self, graphItem):
         if graphItem in self.index_graphItem.keys():
             self.remove_annotation(self.index_graphItem[graphItem])
 
+    def _journal(self, op):
+        self.journal.record(op)
+        # compact the journal into the checkpoint from time to time,
+        # the annotation file keeps the saved state until the user saves
+        limit = self.config['JournalCompactOps']
+        if limit is not None and self.journal.count >= limit and self.journal.checkpoint is not None:
+            self._write_snapshot(self.journal.checkpoint)
+
     #########################
     #### annotation save ####
     #########################
 
-    def save(self, inquiry=True):
-        if not self.config.saved and self.annotation_path is not None:
+    def save(self, inquiry=True, block=True):
+        '''
+        Args:
+            block: wait until the file is written, otherwise it is written in the background
+        '''
+        if self.config.saved:
+            # nothing to save, the rest of a chunked load is dropped, an unread journal stays on disk
+            self._stop_loading()
+            return
+        self.finish_loading()
+        if self.annotation_path is not None:
             save = QMessageBox.Yes == QMessageBox.question(None, "Important...", "Would you like to save the changes in your annotations?", QMessageBox.Yes | QMessageBox.No) if inquiry else True
             if save and self.annotation_path is not None:
-                self.save_to_file(self.annotation_path)
+                self.save_to_file(self.annotation_path, block=block)
+            else:
+                # a pending compaction writes the checkpoint and removes its rotated journal
+                self.saver.flush(self.annotation_path)
+                if self.journal.checkpoint is not None:
+                    self.saver.flush(self.journal.checkpoint)
+                self.journal.discard()
             self.config.saved = True
 
-    def save_to_file(self, filename):
+    def save_to_file(self, filename, block=True):
 
         if self.config.saved is False:
-            anno_file = {'status': self.status,
-                         'labels': self.labelMgr.render_save(),
-                         'annotations': {}}
-            for timestamp, anno in self.items():
-                anno_file['annotations'][timestamp] = anno.render_save()
-            with open(filename, 'w') as f:
-                json.dump(anno_file, f)
-
+            self._write_snapshot(filename)
+            if block:
+                self.saver.flush(filename)
             self.config.saved = True
 
+    def _write_snapshot(self, filename):
+        '''
+        queue a snapshot of the current state, config.saved is left as it is,
+        the journal is removed once a snapshot containing its edits is written
+        '''
+        # the snapshot needs every annotation
+        self.finish_loading()
+        anno_file = {'status': self.status,
+                     'labels': self.labelMgr.render_save(),
+                     'annotations': {}}
+        for timestamp, anno in self.items():
+            anno_file['annotations'][timestamp] = anno.render_save()
+        checkpoint = self.journal.checkpoint
+        is_checkpoint = filename == checkpoint
+        # the journal belongs to the file or its checkpoint
+        owned = checkpoint is not None and (is_checkpoint or self.journal.path == journal_path(filename))
+        rotated = None
+        if owned:
+            # earlier snapshots remove the rotated journal when written
+            self.saver.flush(self.annotation_path)
+            self.saver.flush(checkpoint)
+            rotated = self.journal.rotate()
+        summary = summarize(anno_file)
+        def on_written():
+            if rotated is not None and os.path.isfile(rotated):
+                os.remove(rotated)
+            if not is_checkpoint:
+                # the saved file supersedes the compacted edits
+                if owned and os.path.isfile(checkpoint):
+                    os.remove(checkpoint)
+                SUMMARY_CACHE.put(filename, summary)
+        self.saver.put(filename, anno_file, on_written)
+
+    def flush(self):
+        '''
+        block until all queued annotation files are written
+        '''
+        self.saver.flush()
+
     def close(self):
         self.clear()
         self.labelMgr.clear()
@@ -155,10 +284,12 @@ class AnnotationManager(Table):
         if self.config.saved is False:
             self.save(inquiry=True)
         self.clear()
+        # the file may still be queued for saving
+        self.saver.flush(annotation_path)
 
         ## hdf5 
         fname, ext = os.path.splitext(annotation_path)
-        if not os.path.isfile(annotation_path) and ext == ANNOTATION_EXT:
+        if not os.path.isfile(annotation_path) and ext in [ANNOTATION_EXT, BINARY_ANNOTATION_EXT]:
             self.load(fname  + '.hdf5')
             self.annotation_path = annotation_path
             self.config.saved = False
@@ -186,18 +317,106 @@ class AnnotationManager(Table):
 
                     location.flush()
                     location.close()
+            elif graphItem and self.canvas is not None:
+                self._start_loading(annotation_path)
             else:
-                with open(annotation_path, mode='r') as f:
-                    anno_file = json.load(f)
-                    # load status
-                    self.status = anno_file['status']
-                    # load property and label list
-                    self.labelMgr.parse_labels(anno_file['labels'], increment=False) 
-                    # load annotations
-                    for timestamp, anno in anno_file['annotations'].items():
-                        annotation = self._load_annotation(anno)
-                        if annotation is not None:
-                            self.add_annotation(annotation, graphItem)
+                anno_file, replayed, checkpointed = load_with_journal(annotation_path)
+                # load status
+                self.status = anno_file['status']
+                # load property and label list
+                self.labelMgr.parse_labels(anno_file['labels'], increment=False) 
+                # load annotations
+                for timestamp, anno in anno_file['annotations'].items():
+                    annotation = self._load_annotation(anno)
+                    if annotation is not None:
+                        self.add_annotation(annotation, graphItem)
+                self._recovered(replayed, checkpointed)
+                self.journal.open(annotation_path)
+
+    #### chunked loading: 
+    #### the file is parsed in a background thread, 
+    #### graphics items are inserted in time-sliced batches on the GUI thread
+
+    def _start_loading(self, annotation_path):
+        state = {'path': annotation_path, 'file': None, 'error': None, 'annotations': None, 'pos': 0, 'start': time.time()}
+        # the journal is short (compacted regularly), its operations are read here and it is opened at once,
+        # so edits made while the file is parsed are journaled and not replayed into the parsed file
+        ops = read_ops(annotation_path)
+        self.journal.open(annotation_path)
+        def parse():
+            try:
+                state['file'], state['replayed'], state['checkpointed'] = load_with_journal(annotation_path, ops)
+            except (OSError, ValueError, KeyError) as e:
+                state['error'] = e
+        state['thread'] = threading.Thread(target=parse, daemon=True)
+        state['thread'].start()
+        state['timer'] = QTimer()
+        state['timer'].setInterval(0)
+        state['timer'].timeout.connect(lambda: self._load_step(state))
+        self.loading = state
+        # the BSP index of the scene is rebuilt once after the bulk insert
+        self.canvas.setItemIndexMethod(QGraphicsScene.NoIndex)
+        state['timer'].start()
+
+    def _load_step(self, state, block=False):
+        if state is not self.loading:
+            state['timer'].stop()
+            return
+        if state['annotations'] is None:
+            if state['thread'].is_alive():
+                if not block:
+                    return
+                state['thread'].join()
+            if state['error'] is not None:
+                print('WARN: Annotation Not Loaded: ', state['error'])
+                self._stop_loading()
+                return
+            anno_file = state['file']
+            # load status
+            self.status = anno_file['status']
+            # load property and label list
+            self.labelMgr.parse_labels(anno_file['labels'], increment=False)
+            state['annotations'] = list(anno_file['annotations'].values())
+            state['file'] = None
+            self._recovered(state['replayed'], state['checkpointed'])
+            if self.on_labels_loaded is not None:
+                self.on_labels_loaded()
+        # load annotations
+        annotations, t_start = state['annotations'], time.time()
+        while state['pos'] < len(annotations) and (block or time.time() - t_start < LOAD_SLICE):
+            annotation = self._load_annotation(annotations[state['pos']])
+            state['pos'] += 1
+            if annotation is not None:
+                self.add_annotation(annotation)
+        if state['pos'] >= len(annotations):
+            print('INFO: {} Annotations Loaded in {} Seconds'.format(len(annotations), time.time()-state['start']))
+            self._stop_loading()
+            self.canvas.sync_overlay()
+
+    def _recovered(self, replayed, checkpointed=False):
+        if checkpointed:
+            print('INFO: Unsaved Edits Recovered from Checkpoint')
+            self.config.saved = False
+        if replayed > 0:
+            print('INFO: {} Unsaved Edits Recovered from Journal'.format(replayed))
+            self.config.saved = False
+
+    def _stop_loading(self):
+        if self.loading is not None:
+            self.loading['timer'].stop()
+            self.loading = None
+            if self.canvas is not None:
+                self.canvas.setItemIndexMethod(QGraphicsScene.BspTreeIndex)
+
+    def is_loading(self):
+        return self.loading is not None
+
+    def finish_loading(self):
+        '''
+        block until the chunked loading is completed
+        '''
+        if self.loading is not None:
+            self._load_step(self.loading, block=True)
 
     def _load_annotation(self, anno, mode='json'):
 
@@ -3,12 +3,68 @@ from PyQt5.QtGui import QPolygonF, QColor, QTransform, QPainter, QPainterPath, Q
 from PyQt5.QtWidgets import QGraphicsPolygonItem, QGraphicsEllipseItem, QGraphicsRectItem, QGraphicsPathItem, QGraphicsItem
 import numpy as np
 import math
+import cv2
 
 from abc import abstractmethod
 from .enumDef import *
 from .labelManager import Property, Label
 
 
+#############################
+#### shared pen / brush  ####
+#############################
+
+_STYLES = {}
+
+def get_style(color, alpha_pen, width_pen, alpha_brush, join=Qt.RoundJoin):
+    '''
+    pen and brush shared by all annotations with the same appearance
+    Args:
+        color: color name '#rrggbb' or tuple (r, g, b)
+    Return: (QPen, QBrush)
+    '''
+    key = (color, alpha_pen, width_pen, alpha_brush, join)
+    if key not in _STYLES:
+        c = QColor(color) if isinstance(color, str) else QColor(*color)
+        c.setAlpha(alpha_pen)
+        pen = QPen(c, width_pen, Qt.SolidLine, Qt.RoundCap, join)
+        c.setAlpha(alpha_brush)
+        brush = QBrush(c, Qt.SolidPattern)
+        _STYLES[key] = (pen, brush)
+    return _STYLES[key]
+
+
+###############################
+#### level of detail (LOD) ####
+###############################
+
+# simplification tolerances in image pixels, 0 is the full resolution
+LOD_TOLERANCES = [0, 1, 2, 4, 8, 16, 32]
+# deviation allowed on screen, in screen pixels
+LOD_SCREEN_TOLERANCE = 0.5
+# shapes with fewer vertices are always drawn in full resolution
+LOD_MIN_VERTICES = 64
+
+def lod_tolerance(scale):
+    '''
+    Args:
+        scale: view scale (screen pixels per image pixel)
+    Return: the largest tolerance in LOD_TOLERANCES not visible at this scale
+    '''
+    tol = LOD_SCREEN_TOLERANCE / scale if scale > 0 else LOD_TOLERANCES[-1]
+    return max([t for t in LOD_TOLERANCES if t <= tol])
+
+def simplify(coords, tolerance, closed):
+    '''
+    Douglas-Peucker simplification of a vertex list
+    Return: QPolygonF
+    '''
+    pts = np.array(coords, dtype=np.float32).reshape((-1, 1, 2))
+    if tolerance > 0:
+        pts = cv2.approxPolyDP(pts, tolerance, closed)
+    return QPolygonF([QPointF(pt[0][0], pt[0][1]) for pt in pts])
+
+
 ############################
 #### annotation classes ####
 ############################
@@ -31,6 +87,11 @@ class Annotation(object):
         self.labelMgr = labelMgr
         self.highlighted = False
         self.config = None
+        # key of the style currently set on the graphObject
+        self.style = None
+        # level of detail: current tolerance and cached simplified shapes
+        self.lod_tolerance = 0
+        self.lod = {}
         self.labels = {}
         self.dataObject = self._dataObject(obj)
         self.graphObject = self._graphObject(self.dataObject)
@@ -71,20 +132,59 @@ class Annotation(object):
             self.sync_disp()
 
     def _color(self, config):
-
+        '''
+        Return: color name or tuple (r, g, b), hashable
+        '''
         if config.disp == SHOW_ALL:
-            color = QColor(self.default_color)
+            color = self.default_color
         elif config.disp == HIDE_ALL:
-            color = QColor('#000000')
+            color = '#000000'
         elif config.disp in self.labels.keys():
             color = self.labels[config.disp].color
-            color = QColor(color[0], color[1], color[2])
+            color = (color[0], color[1], color[2])
         else:
-            color = QColor(SHADOW_COLOR)
+            color = SHADOW_COLOR
 
         return color
 
+    def set_lod(self, tolerance):
+        '''
+        display a simplified shape, only polygons and curves are simplified
+        Args:
+            tolerance: one of LOD_TOLERANCES
+        '''
+        pass
+
+    def _lod_polygon(self, tolerance, closed):
+        '''
+        Return: the simplified QPolygonF, or None if the shape does not change
+        '''
+        if len(self.dataObject['coords']) < LOD_MIN_VERTICES or tolerance == self.lod_tolerance:
+            return None
+        if tolerance not in self.lod:
+            self.lod[tolerance] = simplify(self.dataObject['coords'], tolerance, closed)
+        self.lod_tolerance = tolerance
+        return self.lod[tolerance]
+
+    def _set_style(self, style):
+        '''
+        set pen and brush only if the style changed since the last call
+        Args:
+            style: argument tuple of get_style
+        Return: True if the style changed
+        '''
+        if style == self.style:
+            return False
+        pen, brush = get_style(*style)
+        self.graphObject.setPen(pen)
+        self.graphObject.setBrush(brush)
+        self.style = style
+        return True
+
     def sync_disp(self, config=None):
+        '''
+        Return: (restyled, resized), whether the style and the extent of the item changed
+        '''
         if config is None:
             config = self.config
         else:
@@ -97,15 +197,8 @@ class Annotation(object):
             alpha_brush += config['HighlightIncrAlpha']
         if config.disp == HIDE_ALL:
             alpah_pen, alpha_brush = 0, 0
-        color = self._color(config)
-        color.setAlpha(alpah_pen)
-        pen = QPen(color, width_pen, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-        color.setAlpha(alpha_brush)
-        brush = QBrush(color, Qt.SolidPattern)
-        self.graphObject.setPen(pen)
-        self.graphObject.setBrush(brush)
-
-        return self.graphObject
+        restyled = self._set_style((self._color(config), alpah_pen, width_pen, alpha_brush))
+        return restyled, False
         
     @abstractmethod
     def _dataObject(self, dataObject):
@@ -149,6 +242,8 @@ class DotAnnotation(Annotation):
                 or QGraphicsPolygonItem  
         """
         self.radius = labelMgr.config['DotAnnotationRadius']
+        # radius the current transform was computed for
+        self.disp_radius = self.radius
         super().__init__(timestamp, dot, labelMgr)
         self.default_color = labelMgr.config['DotDefaultColor']
 
@@ -169,24 +264,21 @@ class DotAnnotation(Annotation):
         else:
             self.config = config
         # set transfrom
-        self.graphObject.resetTransform()
-        s = config['DotAnnotationRadius']/self.radius
-        t1, t2 = self.dataObject['coords'][0], self.dataObject['coords'][1]
-        t = QTransform(s,0,0,0,s,0,t1-s*t1, t2-s*t2, 1)
-        self.graphObject.setTransform(t)
+        resized = config['DotAnnotationRadius'] != self.disp_radius
+        if resized:
+            self.graphObject.resetTransform()
+            s = config['DotAnnotationRadius']/self.radius
+            t1, t2 = self.dataObject['coords'][0], self.dataObject['coords'][1]
+            t = QTransform(s,0,0,0,s,0,t1-s*t1, t2-s*t2, 1)
+            self.graphObject.setTransform(t)
+            self.disp_radius = config['DotAnnotationRadius']
         # set appearance
         alpah = 255
         width = config['PenWidth']
         if self.highlighted:
             width += config['HighlightIncrWidthDot']
-        color = self._color(config)
-        color.setAlpha(alpah)
-        pen = QPen(color, width, Qt.SolidLine, Qt.RoundCap, Qt.MiterJoin)
-        brush = QBrush(color, Qt.SolidPattern)
-        self.graphObject.setPen(pen)
-        self.graphObject.setBrush(brush)
-
-        return self.graphObject
+        restyled = self._set_style((self._color(config), alpah, width, alpah, Qt.MiterJoin))
+        return restyled, resized
 
     def _dataObject(self, obj):
         if isinstance(obj, QGraphicsItem):
@@ -235,15 +327,16 @@ class CurveAnnotation(Annotation):
         alpah_pen = 255
         width_pen, alpha_brush = config['CurveAnnotationWidth'], 0
         if self.highlighted:
-            width_pen += config['HighlightIncrWidth'] 
-        color = self._color(config)
-        color.setAlpha(alpah_pen)
-        pen = QPen(color, width_pen, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-        color.setAlpha(alpha_brush)
-        brush = QBrush(color, Qt.SolidPattern)
-        self.graphObject.setPen(pen)
-        self.graphObject.setBrush(brush)
-        return self.graphObject
+            width_pen += config['HighlightIncrWidth']
+        restyled = self._set_style((self._color(config), alpah_pen, width_pen, alpha_brush))
+        return restyled, False
+
+    def set_lod(self, tolerance):
+        polygon = self._lod_polygon(tolerance, closed=False)
+        if polygon is not None:
+            curve = QPainterPath()
+            curve.addPolygon(polygon)
+            self.graphObject.setPath(curve)
     
     def _graphObject(self, obj):
         curve = QPainterPath()
@@ -300,6 +393,10 @@ class PolygonAnnotation(Annotation):
         """
         super().__init__(timestamp, polygon, labelMgr)
 
+    def set_lod(self, tolerance):
+        polygon = self._lod_polygon(tolerance, closed=True)
+        if polygon is not None:
+            self.graphObject.setPolygon(polygon)
 
     def _graphObject(self, obj):
         polygon = QPolygonF([QPointF(pt[0], pt[1]) for pt in obj['coords']])
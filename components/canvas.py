@@ -1,12 +1,14 @@
 # from PyQt5.QtGui import *
 from PyQt5 import QtCore
-from PyQt5.QtCore import QTimer, Qt, QRect
+from PyQt5.QtCore import QTimer, Qt, QRect, QRectF
 from PyQt5.QtWidgets import QGraphicsScene, QGraphicsSceneMouseEvent, QGraphicsPathItem, QGraphicsView, QSizePolicy
-from PyQt5.QtGui import QImage, QPixmap, QTransform, QCursor
+from PyQt5.QtGui import QImage, QPixmap, QTransform, QCursor, QPen
 import numpy as np
 # from PIL import Image
 
 from .image import Image
+from .tiles import TiledImageItem
+from .overlay import AnnotationOverlay
 from .livewire import Livewire
 from .commands import *
 from .enumDef import *
@@ -16,6 +18,7 @@ class Canvas(QGraphicsScene):
 
     signalAnnotationSelected = QtCore.pyqtSignal(Annotation)
     signalAnnotationReleased = QtCore.pyqtSignal()
+    signalLivewireUpdated = QtCore.pyqtSignal()
 
     def __init__(self, config, image, annotationMgr, parent=None):
         
@@ -31,26 +34,40 @@ class Canvas(QGraphicsScene):
         self.view.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
         self.view.show()
         self.bgPixmap = self.addPixmap(QPixmap.fromImage(QImage('icons/startscreen.png')))
+        # tiled background for very large images
+        self.bgTiles = TiledImageItem()
+        self.bgTiles.setZValue(-1)
+        self.addItem(self.bgTiles)
+        # rasterized annotations for dense scenes, above the background
+        self.overlay = AnnotationOverlay(self.annotationMgr)
+        self.addItem(self.overlay)
         # setup livewire
         self.livewire = Livewire()
         self.livewire.set_image(image)
+        # emitted from the livewire worker thread, delivered queued to the GUI thread
+        self.livewire.on_update = self.signalLivewireUpdated.emit
+        self.signalLivewireUpdated.connect(self.livewire_updated)
         # run-time status
         self.selected = []
         self.tool = BROWSE
         self.drawing = False
         self.currentCommand = None
         self.currentScale = 1
+        self.lodTolerance = 0
         # time part
         # error occurs when pass event through signal
         self.time = None
         self.clickPos = None
         self.clickBtn = None
+        # rubber band (shift + drag in browse mode)
+        self.rubberBand = None
     
     def clear(self):
         for item in self.items():
-            if item != self.bgPixmap:
+            if item != self.bgPixmap and item != self.bgTiles and item != self.overlay:
                 self.removeItem(item)
         self.selected.clear()
+        self.overlay.clear()
 
     ###############################
     #### graph item management ####
@@ -58,10 +75,12 @@ class Canvas(QGraphicsScene):
 
     def add_item(self, anno):
         graphObj = anno.graphObject
+        anno.set_lod(self.lodTolerance)
         self.addItem(graphObj)
         anno.sync_disp(self.config)
 
     def remove_item(self, anno):
+        self.overlay.remove(anno)
         self.removeItem(anno.graphObject)
 
     # def add_graphItems(self):
@@ -73,6 +92,7 @@ class Canvas(QGraphicsScene):
         for anno in self.selected:
             label.assign(anno)
             anno.sync_disp(self.config)
+            self.overlay.invalidate(anno)
         if len(self.selected) > 0:
             anno = self.selected[-1]
             self.signalAnnotationSelected.emit(anno)
@@ -82,7 +102,7 @@ class Canvas(QGraphicsScene):
     ######################### 
 
     def screenshot(self):
-        sz = self.bgPixmap.boundingRect()
+        sz = self.bgTiles.boundingRect() if self.bgTiles.is_active() else self.bgPixmap.boundingRect()
         sz = self.view.mapFromScene(sz).boundingRect() 
         return self.view.grab(sz)  
     
@@ -93,10 +113,24 @@ class Canvas(QGraphicsScene):
     def zoom(self, scale):
         self.view.scale(scale,scale)
         self.currentScale = self.currentScale * scale
+        self.sync_lod()
 
     def recovery_scale(self):
         self.view.scale(1/self.currentScale, 1/self.currentScale)
         self.currentScale = 1
+        self.sync_lod()
+
+    def sync_lod(self):
+        '''
+        switch polygons and curves to the simplification level matching the view scale
+        '''
+        # the view transform also includes the fit-to-window scale of sync_image
+        tolerance = lod_tolerance(self.view.transform().m11())
+        if tolerance != self.lodTolerance:
+            self.lodTolerance = tolerance
+            for _, anno in self.annotationMgr.items():
+                anno.set_lod(tolerance)
+            self.overlay.invalidate()
 
     ###################################
     #### synchronize image display ####
@@ -104,24 +138,63 @@ class Canvas(QGraphicsScene):
 
     def sync(self, rescale=True):
         self.sync_image(rescale=rescale)
+        self.sync_overlay()
         self.sync_disp()
 
+    def sync_overlay(self):
+        '''
+        switch to the rasterized overlay when the number of annotations exceeds the threshold
+        '''
+        threshold = self.config['OverlayThreshold']
+        active = self.image.is_open() and threshold is not None and len(self.annotationMgr.keys()) > threshold
+        if active:
+            self.overlay.set_active(True, self.image.width, self.image.height)
+        elif self.overlay.is_active():
+            self.overlay.set_active(False)
+
     def sync_image(self, rescale=True):
         if self.image.is_open():
-            self.bgPixmap.setPixmap(QPixmap.fromImage(self.image.get_QImage()))
+            if self.image.width * self.image.height > self.config['TiledImageThreshold']:
+                self.bgPixmap.setPixmap(QPixmap())
+                # tiles are only rebuilt when the frame or the contrast changed,
+                # they are converted to 8 bit one by one, the frame is not copied
+                key = self.image.disp_key()
+                if not self.bgTiles.is_active() or self.bgTiles.key != key:
+                    self.bgTiles.set_image(self.image.disp, key, self.image.to_disp8)
+            else:
+                self.bgTiles.clear()
+                self.bgPixmap.setPixmap(QPixmap.fromImage(self.image.get_QImage()))
             if rescale:
                 self.view.setSceneRect(0,0,self.image.width,self.image.height)
                 vis_rect = self.view.mapToScene(self.view.rect()).boundingRect()
                 scale = min(vis_rect.width()/self.image.width, vis_rect.height()/self.image.height)
                 self.view.scale(scale, scale)
+                self.sync_lod()
             if self.tool == LIVEWIRE:
                 self.livewire.sync_image()
 
     def sync_disp(self):
+        changed = False
         for _, anno in self.annotationMgr.items():
-            # print('sss', anno.labels)
-            anno.sync_disp(self.config)
+            restyled, resized = anno.sync_disp(self.config)
+            # only dots whose radius changed need a new index box
+            if resized:
+                self.annotationMgr.update_index(anno)
+            changed = changed or restyled or resized
+        if changed:
+            self.overlay.invalidate()
+
+    def visible_annotations(self):
+        '''
+        Return: annotations intersecting the visible part of the scene
+        '''
+        vis_rect = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        return self.annotationMgr.annotations_in_rect(vis_rect)
     
+    def livewire_updated(self):
+        if self.tool == LIVEWIRE and self.drawing:
+            self.currentCommand.refresh()
+
     def set_tool(self, tool, paras=None):
         self.tool = tool
         paras = paras if isinstance(paras, dict) else {}
@@ -137,6 +210,8 @@ class Canvas(QGraphicsScene):
     def highlight_selected_items(self, status):
         for item in self.selected:
             item.highlight(status)
+            # selected annotations are live graphics items
+            self.overlay.set_live(item, status)
 
     ###########################################
     #### mouse and keyboard event handling ####
@@ -148,6 +223,10 @@ class Canvas(QGraphicsScene):
             self.currentCommand.cancel()
 
     def mousePressEvent(self, event):
+        if self.tool == BROWSE and event.button() == Qt.LeftButton and event.modifiers() & Qt.ShiftModifier:
+            self.rubberBand = self.addRect(QRectF(event.scenePos(), event.scenePos()), QPen(Qt.white, 0, Qt.DashLine))
+            self.rubberBand.setData(0, event.scenePos())
+            return
         self.event = event
         self.clickPos = self.event.scenePos()
         self.clickBtn = self.event.button()
@@ -212,6 +291,9 @@ class Canvas(QGraphicsScene):
 
     def mouseMoveEvent(self, event):
         assert isinstance(event, QGraphicsSceneMouseEvent)
+        if self.rubberBand is not None:
+            self.rubberBand.setRect(QRectF(self.rubberBand.data(0), event.scenePos()).normalized())
+            return
         if self.tool == POLYGON and self.drawing:
             self.currentCommand.mouseMoveEvent(event)
         elif self.tool == LIVEWIRE and self.drawing:
@@ -223,6 +305,13 @@ class Canvas(QGraphicsScene):
         elif self.tool == ELLIPSE and self.drawing:
             self.currentCommand.mouseMoveEvent(event)
 
+    def mouseReleaseEvent(self, event):
+        if self.rubberBand is not None:
+            rect = self.rubberBand.rect()
+            self.removeItem(self.rubberBand)
+            self.rubberBand = None
+            self.select_in_rect(rect, add=bool(event.modifiers() & Qt.ControlModifier))
+
     def wheelEvent(self, event):
         pass
 
@@ -245,12 +334,14 @@ class Canvas(QGraphicsScene):
     def selectItem(self, event):
         self.highlight_selected_items(False)
 
-        item = self.itemAt(event.scenePos(), QTransform())
-        anno = self.annotationMgr.get_annotation_by_graphItem(item)
+        # picking through the spatial index, the background is never hit
+        annos = self.annotationMgr.annotations_at(event.scenePos())
+        anno = annos[0] if len(annos) > 0 else None
         if not event.modifiers() & Qt.ControlModifier:
             self.selected.clear()
-        if anno is not None and item is not self.bgPixmap and item not in self.selected:
-            self.selected.append(anno)
+        if anno is not None:
+            if anno not in self.selected:
+                self.selected.append(anno)
             self.signalAnnotationSelected.emit(anno)
         else:
             self.signalAnnotationReleased.emit()
@@ -258,6 +349,26 @@ class Canvas(QGraphicsScene):
 
         self.highlight_selected_items(True)
 
+    def select_in_rect(self, rect, add=False):
+        '''
+        rubber-band selection of all annotations whose shapes intersect rect
+        Args:
+            rect: QRectF in scene coordinates
+            add: keep the current selection
+        '''
+        self.highlight_selected_items(False)
+        if not add:
+            self.selected.clear()
+        for anno in self.annotationMgr.annotations_in_rect(rect):
+            item = anno.graphObject
+            if anno not in self.selected and item.shape().intersects(item.mapFromScene(rect)):
+                self.selected.append(anno)
+        if len(self.selected) > 0:
+            self.signalAnnotationSelected.emit(self.selected[-1])
+        else:
+            self.signalAnnotationReleased.emit()
+        self.highlight_selected_items(True)
+
     def deleteItem(self):
         if self.drawing:
             self.cancel_operation()
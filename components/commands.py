@@ -184,34 +184,72 @@ class PolygonPainter(BaseToolClass):
 
 class LivewirePainter(PolygonPainter):
 
-    def __init__(self, canvas, annotationMgr, start, radius=100):
+    def __init__(self, canvas, annotationMgr, start, radius=None):
+        '''
+        Args:
+            radius: live radius of each seed, None expands lazily towards the cursor
+        '''
         super().__init__(canvas, annotationMgr, start)
 
         self.radius = radius
         self.poly_tmp = QPolygonF()
+        self.cursor = start
+        # clicked points whose path is not settled yet, committed in order as the worker settles them
+        self.pending = []
         # self.canvas.sync_livewire_image()
         self.canvas.livewire.set_seed(self.start.x(), self.start.y(), self.radius)
         print('======== Livewire Drawing ========')
          
     def mouseSingleClickEvent(self, pt):
-        path_x, path_y = self.canvas.livewire.get_path(pt.x(), pt.y())
-        self.canvas.livewire.set_seed(pt.x(), pt.y(), self.radius)
-        for i in reversed(range(len(path_x)-1)):
-            self.polygon << QPointF(path_x[i], path_y[i])
-        self.polygonItem.setPolygon(self.polygon)
+        # the clicked point is part of the annotation, its path is committed once settled, the GUI never waits
+        self.pending.append(pt)
+        self.refresh()
+
+    def commit(self, force=False):
+        '''
+        append the paths of the settled pending points to the polygon, each becomes the next seed
+        Args:
+            force: commit all pending points with the best paths available so far
+        '''
+        livewire = self.canvas.livewire
+        while len(self.pending) > 0:
+            pt = self.pending[0]
+            if not force and not livewire.is_settled(pt.x(), pt.y()):
+                break
+            path_x, path_y = livewire.get_path(pt.x(), pt.y())
+            self._append(self.polygon, path_x, path_y)
+            livewire.set_seed(pt.x(), pt.y(), self.radius)
+            self.pending.pop(0)
+        self.polygonItem.setPolygon(self.polygon+self.poly_tmp)
         self.polygonItem.update()
 
+    def _append(self, polygon, path_x, path_y):
+        # the last point of a path is the seed, already in the polygon, a path of one point did not reach it
+        for i in reversed(range(max(len(path_x)-1, 1))):
+            polygon << QPointF(path_x[i], path_y[i])
+
     def mouseMoveEvent(self, event):
-        pt = event.scenePos()
+        self.cursor = event.scenePos()
+        self.refresh()
+
+    def refresh(self):
+        '''
+        commit the settled clicks, redraw the rest with the best result available so far,
+        while a click is pending, its path is the one the worker settles
+        '''
+        self.commit()
         self.poly_tmp.clear()
-        path_x, path_y = self.canvas.livewire.get_path(pt.x(), pt.y())
-        for i in reversed(range(len(path_x)-1)):
-            self.poly_tmp << QPointF(path_x[i], path_y[i])
+        points = self.pending + [self.cursor]
+        path_x, path_y = self.canvas.livewire.get_path(points[0].x(), points[0].y())
+        self._append(self.poly_tmp, path_x, path_y)
+        for pt in points[1:]:
+            self.poly_tmp << pt
         self.polygonItem.setPolygon(self.polygon+self.poly_tmp)
         self.polygonItem.update()
 
     def process(self):
-        self.mouseSingleClickEvent
+        self.poly_tmp.clear()
+        self.commit(force=True)
         super().process()
         self.canvas.set_tool(LIVEWIRE)
     
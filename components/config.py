@@ -25,6 +25,19 @@ class Config(dict):
 
         self['DotDefaultColor'] = '#cc0000'
 
+        # images larger than this (in pixels) are rendered as tiles
+        self['TiledImageThreshold'] = 4096 * 4096
+        # with more annotations than this, non-selected ones are rasterized (None to disable)
+        self['OverlayThreshold'] = 5000
+        # journaled edits after which the annotation file is rewritten (None to disable)
+        self['JournalCompactOps'] = 200
+        # file and directory names (glob patterns) skipped when scanning directories for images
+        self['ScanExclude'] = ['.*', '$RECYCLE.BIN', 'System Volume Information']
+        # depth of subdirectories scanned (None for no limit)
+        self['ScanMaxDepth'] = None
+        # processes used for exporting annotations (None for the number of cpus)
+        self['ExportWorkers'] = None
+
         self.saved = True
         self.disp = SHOW_ALL
         self.pre_disp = SHOW_ALL
@@ -6,6 +6,9 @@ CONFIRMED = 'confirmed'
 PROBLEM = 'problematic'
 
 ANNOTATION_EXT = '.json'
+JOURNAL_EXT = '.journal'
+# binary annotation container, components.annoBinary
+BINARY_ANNOTATION_EXT = '.annb'
 
 BROWSE = 'browse'
 POLYGON = 'polygon'
@@ -0,0 +1,148 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from collections import deque
+import shutil
+import os
+import cv2
+
+from .func_export import export_mask, export_semantic, export_bbx, createXml, extract_patch, dense_mask, export_coco
+
+# jobs in flight per worker process, bounds the memory held by results and queued jobs
+EXPORT_WINDOW_PER_WORKER = 2
+# seconds between progress callbacks while waiting for a job
+EXPORT_POLL = 0.05
+# outputs are written under a temporary name and renamed in order by the caller
+EXPORT_TMP_NAME = '.job_{:08d}'
+
+'''
+an export job is a picklable dict describing one image:
+    pos: position of the job, used for the temporary name
+    kind: 'mask', 'semantic', 'bbx', 'patch' or 'coco'
+    as_one: one mask for all objects (mask, semantic), otherwise one file per object in a directory
+    anno, img: annotation and image path
+    save_dir: output directory
+    labels: labels to export ({property: [labels]}, None for all objects) of 'mask' and 'patch'
+    category, semantic_labels, export_undefined: of 'semantic', 'bbx' and 'coco'
+    rle: masks as run-length encoding, of 'coco'
+    padding: of 'patch'
+    meta: image metadata (width, height, channels ...) from the project index, None to read the image header
+    export_empty: write outputs without objects
+'''
+
+def export_output(job):
+    '''
+    Return: temporary output name of the job, a file or a directory
+    '''
+    if job['kind'] == 'coco':
+        return None
+    if job['kind'] in ['mask', 'semantic'] and job['as_one']:
+        return EXPORT_TMP_NAME.format(job['pos']) + '.png'
+    elif job['kind'] == 'bbx':
+        return EXPORT_TMP_NAME.format(job['pos']) + '.xml'
+    else:
+        return EXPORT_TMP_NAME.format(job['pos'])
+
+def export_image(job):
+    '''
+    export one image, runs in a worker process
+    Return: temporary output name (None if nothing is written), for patches whether each patch has a mask
+    '''
+    kind, name = job['kind'], export_output(job)
+    path = os.path.join(job['save_dir'], name)
+    if kind == 'mask':
+        export, is_empty = export_mask(job['anno'], job['img'], save_as_one=job['as_one'], export_labels=job['labels'], meta=job['meta'])
+    elif kind == 'semantic':
+        export, is_empty = export_semantic(job['anno'], job['img'], job['category'], job['semantic_labels'],
+                                           export_undefined=job['export_undefined'], save_as_one=job['as_one'], meta=job['meta'])
+    elif kind == 'bbx':
+        export, is_empty = export_bbx(job['anno'], job['img'], job['category'], job['semantic_labels'], export_undefined=job['export_undefined'])
+    elif kind == 'patch':
+        imgs, masks = extract_patch(job['anno'], job['img'], job['padding'], export_labels=job['labels'])
+        # images without patches are never exported
+        if len(imgs) == 0:
+            return None, []
+        os.makedirs(os.path.join(path, 'images'))
+        os.makedirs(os.path.join(path, 'masks'))
+        for j in range(len(imgs)):
+            imgs[j].save(os.path.join(path, 'images', 'patch_{:03d}.png'.format(j)))
+            if masks[j] is not None:
+                cv2.imwrite(os.path.join(path, 'masks', 'patch_{:03d}.png'.format(j)), masks[j])
+        return name, [m is not None for m in masks]
+    else:
+        return None, []
+
+    if (not job['export_empty']) and is_empty:
+        return None, []
+    if kind == 'bbx':
+        createXml(export, job['img'], path, meta=job['meta'])
+    elif job['as_one']:
+        cv2.imwrite(path, export)
+    else:
+        os.makedirs(path)
+        # per object masks are sparse, expanded one at a time
+        for j, mask in enumerate(export):
+            cv2.imwrite(os.path.join(path, 'obj_{:03d}.png'.format(j)), dense_mask(mask))
+    return name, []
+
+def export_coco_image(job):
+    '''
+    COCO objects of one image, runs in a worker process, nothing is written
+    Return: list of objects, width, height
+    '''
+    return export_coco(job['anno'], job['img'], job['category'], job['semantic_labels'],
+                       export_undefined=job['export_undefined'], rle=job['rle'], meta=job['meta'])
+
+def remove_output(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+def run_jobs(jobs, handle, progress=None, cancelled=None, workers=None, func=export_image):
+    '''
+    run export jobs on a process pool, results are handled in the order of the jobs
+    Args:
+        jobs: list of export jobs
+        handle: handle(job, result), called in the calling thread, in order, result is None if the job failed
+        progress: progress(done), called in the calling thread, also while waiting
+        cancelled: cancelled() -> bool, outputs of jobs not handled yet are removed after cancellation
+        workers: number of processes, the number of cpus if None
+        func: job function, export_image or export_coco_image
+    Return: number of handled jobs
+    '''
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    window = workers * EXPORT_WINDOW_PER_WORKER
+    done, queue, pending = 0, deque(jobs), deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(pending) > 0 or len(queue) > 0:
+            while len(pending) < window and len(queue) > 0:
+                job = queue.popleft()
+                pending.append((job, pool.submit(func, job)))
+            if cancelled is not None and cancelled():
+                break
+            job, future = pending[0]
+            try:
+                result = future.result(timeout=EXPORT_POLL)
+            except TimeoutError:
+                if progress is not None:
+                    progress(done)
+                continue
+            except Exception as e:
+                print('WARN: Export Failed: ', job['img'], e)
+                result = None
+            pending.popleft()
+            handle(job, result)
+            done += 1
+            if progress is not None:
+                progress(done)
+        # cancelled, drop what is not handled
+        for job, future in pending:
+            future.cancel()
+        for job, future in pending:
+            if not future.cancelled():
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            if export_output(job) is not None:
+                remove_output(os.path.join(job['save_dir'], export_output(job)))
+    return done
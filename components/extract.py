@@ -7,6 +7,8 @@ from .enumDef import *
 from .fileList import FolderTreeItem, ImageTreeItem
 from .func_annotation import *
 from .func_export import *
+from .annoSummary import summary_props
+from .exportEngine import run_jobs, export_image, export_coco_image
 import numpy as np
 from datetime import datetime
 from PIL import Image
@@ -26,8 +28,25 @@ TP_SEMANTIC_SINGLE = "Semantic-Single (.png): semantic map in one image, objects
 TP_SEMANTIC_MULTI = "Semantic-Multiple (.png): semantic map, one map per object"
 TP_BBX = "Bounding Box (.xml): PASCAL VOC format"
 TP_PATCH = "Patches (.png)"
+TP_COCO = "COCO (.json): polygons or RLE masks of all images in one file"
 # TP_SKELETON = "Skeleton (.png)"
 
+# export job kind and whether all objects go into one file
+EXPORT_KINDS = {TP_INSTANCE_SINGLE: ('mask', True),
+                TP_INSTANCE_MULTI: ('mask', False),
+                TP_SEMANTIC_SINGLE: ('semantic', True),
+                TP_SEMANTIC_MULTI: ('semantic', False),
+                TP_BBX: ('bbx', True),
+                TP_PATCH: ('patch', False),
+                TP_COCO: ('coco', True)}
+# names of the exported files / directories
+EXPORT_NAMES = {TP_INSTANCE_SINGLE: "instance_{:08d}.png",
+                TP_INSTANCE_MULTI: "instance_{:08d}",
+                TP_SEMANTIC_SINGLE: "semantc_{:08d}.png",
+                TP_SEMANTIC_MULTI: "semantic_{:08d}",
+                TP_BBX: "bbx_{:08d}.xml",
+                TP_PATCH: "patch_{:08d}"}
+
 class AnnoExporter(QDialog):
     def __init__(self, config, project=None, parent=None):
         super().__init__(parent=parent)
@@ -45,6 +64,7 @@ class AnnoExporter(QDialog):
         self.exportType.addItem(TP_SEMANTIC_MULTI)
         self.exportType.addItem(TP_BBX)
         self.exportType.addItem(TP_PATCH)
+        self.exportType.addItem(TP_COCO)
         # self.exportType.addItem(TP_SKELETON)
 
         # init padding value bar
@@ -80,6 +100,9 @@ class AnnoExporter(QDialog):
         self.exportAllObjects.stateChanged.connect(self.check_exportAllObjects_constraint)
         self.exportType.currentTextChanged.connect(self.update_ui)
         self.btnExport.clicked.connect(self.export)
+        self.btnCancel.clicked.connect(self.cancel)
+        self.btnCancel.setEnabled(False)
+        self.cancelled = False
         self.update_ui(TP_INSTANCE_SINGLE)
 
     ## getter of selected items
@@ -134,7 +157,7 @@ class AnnoExporter(QDialog):
 
     def check_semantic_constraint(self, item=None):
         # if semantic, maximal one category could be selected
-        if str(self.exportType.currentText()) in [TP_SEMANTIC_SINGLE, TP_SEMANTIC_MULTI, TP_BBX]:
+        if str(self.exportType.currentText()) in [TP_SEMANTIC_SINGLE, TP_SEMANTIC_MULTI, TP_BBX, TP_COCO]:
             self.labelList.blockSignals(True)
             index = -1
             if item is None:
@@ -159,7 +182,7 @@ class AnnoExporter(QDialog):
         # no selection is necessary, if instance 
         status = self.exportAllObjects.checkState() if status is None else status
         if status == Qt.Checked:
-            if str(self.exportType.currentText()) in [TP_SEMANTIC_SINGLE, TP_SEMANTIC_MULTI, TP_BBX]:
+            if str(self.exportType.currentText()) in [TP_SEMANTIC_SINGLE, TP_SEMANTIC_MULTI, TP_BBX, TP_COCO]:
                 self.labelList.collapseAll()
                 self.labelList.setItemsExpandable(False)
                 self.labelList.setEnabled(True)
@@ -195,7 +218,7 @@ class AnnoExporter(QDialog):
                 items.append(item_c)
         _, anno_files, _ = self.files(items)
 
-        props = anno_props(anno_files)
+        props = summary_props(anno_files)
 
         for p, lbs in props.items():
             p_item = QTreeWidgetItem(PROPERTY)
@@ -253,6 +276,7 @@ class AnnoExporter(QDialog):
     def update_ui(self, text):
         text = str(text)
         self.valuePadding.setEnabled(False)
+        self.exportRLE.setEnabled(False)
         # self.exportUndefinedObject.setEnabled(True)
         # self.exportUndefinedObject.setCheckState(Qt.Unchecked)
         self.labelList.setEnabled(True)
@@ -269,11 +293,17 @@ class AnnoExporter(QDialog):
             self.exportEmptyImage.setEnabled(False)
         elif text == TP_BBX:
             self.check_semantic_constraint()
+        elif text == TP_COCO:
+            self.exportRLE.setEnabled(True)
+            self.check_semantic_constraint()
         # elif text == TP_SKELETON:
         #     pass
 
         self.check_exportAllObjects_constraint()
 
+    def cancel(self):
+        self.cancelled = True
+
     def export(self):
         self.progressBar.setValue(0)
         
@@ -292,6 +322,8 @@ class AnnoExporter(QDialog):
                 suffix = '-bbx-'
             elif exportType == TP_PATCH:
                 suffix = '-patch-'
+            elif exportType == TP_COCO:
+                suffix = '-coco-'
             # elif exportType == TP_SKELETON:
             #     suffix = '-skeleton-'
             else:
@@ -306,7 +338,7 @@ class AnnoExporter(QDialog):
             images, annotations, idxs = self.files(image_items)
             # selected labels:
             labels = self.selected_labels()
-            if str(self.exportType.currentText()) in [TP_SEMANTIC_SINGLE, TP_SEMANTIC_MULTI, TP_BBX] and len(labels) > 0:
+            if str(self.exportType.currentText()) in [TP_SEMANTIC_SINGLE, TP_SEMANTIC_MULTI, TP_BBX, TP_COCO] and len(labels) > 0:
                 category = list(labels.keys())[0]
                 semantic_labels = {}
                 with open(os.path.join(save_dir, 'labels.csv'), mode='w', newline='') as files:
@@ -319,138 +351,85 @@ class AnnoExporter(QDialog):
 
 
 
-            # export annotations and the list
-            total = len(images)
+            # export jobs, run on a process pool
+            padding = self.valuePadding.value()
+            kind, as_one = EXPORT_KINDS[exportType]
+            if kind in ['mask', 'patch']:
+                export_labels = None if exportAllObjects else labels
+                valid = exportAllObjects or len(labels) > 0
+            else:
+                valid = len(labels) > 0
+            jobs = []
+            if valid:
+                for pos, (img, anno, idx) in enumerate(zip(images, annotations, idxs)):
+                    job = {'pos': pos, 'kind': kind, 'as_one': as_one, 'anno': anno, 'img': img, 'idx': idx,
+                           'save_dir': save_dir, 'export_empty': exportEmpty,
+                           # only the stored meta, a missing header is read by the worker
+                           'meta': self.project.get_image_meta(idx, read=False) if idx is not None else None}
+                    if kind in ['mask', 'patch']:
+                        job.update({'labels': export_labels, 'padding': padding/100})
+                    else:
+                        job.update({'category': category, 'semantic_labels': semantic_labels, 'export_undefined': exportAllObjects,
+                                    'rle': self.exportRLE.checkState() == Qt.Checked})
+                    jobs.append(job)
+
+            # outputs are renamed and listed in the order of the images
+            total = len(jobs)
             with open(os.path.join(save_dir, 'files.csv'), mode='w', newline='') as files:
                 file_writer = csv.writer(files, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                progress, sn = 0, 0
-                for img, anno, idx in zip(images, annotations, idxs):
-                    progress += 1
-                    if int(progress*100/total) - self.progressBar.value() >= 1:
-                        self.progressBar.setValue(progress*100/total)
-                    QCoreApplication.processEvents()
-                    # export mask single
-                    if exportType == TP_INSTANCE_SINGLE:
-                        if exportAllObjects:
-                            export, is_empty = export_mask(anno, img, save_as_one=True, export_labels=None)
-                        elif len(labels) > 0:
-                            export, is_empty = export_mask(anno, img, save_as_one=True, export_labels=labels)
-                        else:
-                            continue
-                        if (not exportEmpty) and is_empty:
-                            continue
-                        sn += 1
-                        save_name = "instance_{:08d}.png".format(sn)
-                        save_path = os.path.join(save_dir, save_name)
-                        cv2.imwrite(save_path, export)
-                        # file_writer.writerow([img, save_path])
-                        file_writer.writerow([idx, img, save_name])
-                    # export mask multiple
-                    elif exportType == TP_INSTANCE_MULTI:
-                        if exportAllObjects:
-                            export, is_empty = export_mask(anno, img, save_as_one=False, export_labels=None)
-                        elif len(labels) > 0:
-                            export, is_empty = export_mask(anno, img, save_as_one=False, export_labels=labels)
-                        else:
-                            continue
-                        if (not exportEmpty) and is_empty:
-                            continue
+                sn = 0
+                # all images go into one COCO file, written in chunks
+                if kind == 'coco':
+                    coco = CocoWriter(os.path.join(save_dir, 'annotations.json'))
+                    coco_root = coco_image_root(images)
+                def handle(job, result):
+                    nonlocal sn
+                    if result is None:
+                        return
+                    if kind == 'coco':
+                        objects, width, height = result
+                        if (not exportEmpty) and len(objects) == 0:
+                            return
                         sn += 1
-                        save_name = "instance_{:08d}".format(sn)
-                        save_path = os.path.join(save_dir, save_name)
-                        # save_path = os.path.join(save_dir, "mask_{:08d}").format(sn)
-                        os.makedirs(save_path)
-                        for j, mask in enumerate(export):
-                            cv2.imwrite(os.path.join(save_path, 'obj_{:03d}.png'.format(j)), mask)
-                        # file_writer.writerow([img, save_path])
-                        file_writer.writerow([idx, img, save_name])
-                    # export semantic single
-                    elif exportType == TP_SEMANTIC_SINGLE:
-                        if len(labels) == 0:
-                            continue
-                        export, is_empty = export_semantic(anno, img, category, semantic_labels, export_undefined=exportAllObjects, save_as_one=True)
-                        if (not exportEmpty) and is_empty:
-                            continue
-                        sn += 1
-                        save_name = "semantc_{:08d}.png".format(sn)
-                        save_path = os.path.join(save_dir, save_name)
-                        # save_path = os.path.join(save_dir, "semantic_{:08d}.png").format(sn)
-                        cv2.imwrite(save_path, export)
-                        file_writer.writerow([idx, img, save_name])
-                    # export semantic multi
-                    elif exportType == TP_SEMANTIC_MULTI:
-                        if len(labels) == 0:
-                            continue
-                        export, is_empty = export_semantic(anno, img, category, semantic_labels, export_undefined=exportAllObjects, save_as_one=False)
-                        if (not exportEmpty) and is_empty:
-                            continue
-                        sn += 1
-                        save_name = "semantic_{:08d}".format(sn)
-                        save_path = os.path.join(save_dir, save_name)
-                        # save_path = os.path.join(save_dir, "semantic_{:08d}").format(sn)
-                        os.makedirs(save_path)
-                        for j, mask in enumerate(export):
-                            cv2.imwrite(os.path.join(save_path, 'obj_{:03d}.png'.format(j)), mask)
-                        file_writer.writerow([idx, img, save_name])
-                    # export bounding box
-                    elif exportType == TP_BBX:
-                        if len(labels) == 0:
-                            continue
-                        export, is_empty = export_bbx(anno, img, category, semantic_labels, export_undefined=exportAllObjects)
-                        if (not exportEmpty) and is_empty:
-                            continue
-                        sn += 1
-                        save_name = "bbx_{:08d}.xml".format(sn)
-                        save_path = os.path.join(save_dir, save_name)
-                        # save_path = os.path.join(save_dir, "bbx_{:08d}.xml").format(sn)
-                        createXml(export, img, save_path)
-                        file_writer.writerow([idx, img, save_name])
-                    # export patches
-                    elif exportType == TP_PATCH:
-                        padding = self.valuePadding.value()
-                        if exportAllObjects:
-                            imgs, masks = extract_patch(anno, img, padding/100, export_labels=None)
-                        elif len(labels) > 0:
-                            imgs, masks = extract_patch(anno, img, padding/100, export_labels=labels)
-                        else:
-                            continue
-                        if len(imgs) == 0:
-                            continue
-                        sn += 1
-                        save_name = "patch_{:08d}".format(sn)
-                        save_path = os.path.join(save_dir, save_name)
-                        # save_path = os.path.join(save_dir, "patch_{:08d}").format(sn)
-                        img_dir = os.path.join(save_path, 'images')
-                        mask_dir = os.path.join(save_path, 'masks')
-                        os.makedirs(img_dir)
-                        os.makedirs(mask_dir)
-                        for j in range(len(imgs)):
-                            # img_patch_path = os.path.join(img_dir, 'patch_{:03d}.png'.format(j))
+                        image_id = coco.add_image(coco_file_name(job['img'], coco_root), width, height, objects)
+                        file_writer.writerow([job['idx'], job['img'], image_id])
+                        return
+                    name, has_masks = result
+                    if name is None:
+                        return
+                    sn += 1
+                    save_name = EXPORT_NAMES[exportType].format(sn)
+                    os.replace(os.path.join(save_dir, name), os.path.join(save_dir, save_name))
+                    if kind == 'patch':
+                        for j, has_mask in enumerate(has_masks):
                             img_patch_name = os.path.join(save_name, 'images', 'patch_{:03d}.png'.format(j))
-                            imgs[j].save(os.path.join(save_dir, img_patch_name))
-                            if masks[j] is not None:
-                                mask_patch_name = os.path.join(save_name, 'masks',  'patch_{:03d}.png'.format(j))
-                                cv2.imwrite(os.path.join(save_dir, mask_patch_name), masks[j])
-                            else:
-                                mask_patch_path = ''
-                            file_writer.writerow([idx, img_patch_name, mask_patch_name])
-                    # elif exportType == TP_SKELETON:
-
-                    #     if exportAllObjects:
-                    #         export, is_empty = export_skeleton(anno, img, export_labels=None)
-                    #     elif len(labels) > 0:
-                    #         export, is_empty = export_skeleton(anno, img, export_labels=labels)
-                    #     else:
-                    #         continue
-                    #     if (not exportEmpty) and is_empty:
-                    #         continue
-                    #     sn += 1
-                    #     save_path = os.path.join(save_dir, "skeleton_{:08d}.png").format(sn)
-                    #     cv2.imwrite(save_path, export.astype(np.uint8)*20)
-                    #     file_writer.writerow([img, save_path])
+                            mask_patch_name = os.path.join(save_name, 'masks',  'patch_{:03d}.png'.format(j)) if has_mask else ''
+                            file_writer.writerow([job['idx'], img_patch_name, mask_patch_name])
+                    else:
+                        file_writer.writerow([job['idx'], job['img'], save_name])
+                def progress(done):
+                    if total > 0 and int(done*100/total) - self.progressBar.value() >= 1:
+                        self.progressBar.setValue(int(done*100/total))
+                    QCoreApplication.processEvents()
+
+                self.cancelled = False
+                self.btnExport.setEnabled(False)
+                self.btnCancel.setEnabled(True)
+                done = run_jobs(jobs, handle, progress, lambda: self.cancelled, workers=self.config['ExportWorkers'],
+                                func=export_coco_image if kind == 'coco' else export_image)
+                self.btnExport.setEnabled(True)
+                self.btnCancel.setEnabled(False)
+                if kind == 'coco':
+                    if done < total:
+                        coco.discard()
                     else:
-                        sn -= 1
-                        print("Unsupported output type")
+                        categories = {v: k for k, v in semantic_labels.items()} if valid else {}
+                        if valid and exportAllObjects:
+                            categories[len(semantic_labels)+1] = 'undefined'
+                        coco.close(categories)
+                if done < total:
+                    print('INFO: Export Cancelled, {} of {} Images Exported'.format(done, total))
+                    return
                     
         
             self.progressBar.setValue(100)    
@@ -310,6 +310,7 @@ class FileListDock(QDockWidget):
                     status = self.project.get_status(idx)
                     status = self._change_mark(item, status)
                     self.project.set_status(idx, status)
+                    self.annotationMgr.saver.flush(self.project.get_annotation_path(idx))
                     set_status(self.project.get_annotation_path(idx), status)
                 else:
                     path = os.path.splitext(item.path)[0] + ANNOTATION_EXT
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import hashlib
+import os
+
+from .image import compute_checksum, CHECKSUM_BYTES
+
+'''
+staged file matching: files are compared by size first, the (cached) checksum of the first
+CHECKSUM_BYTES is only computed within size buckets that collide, the hash of the whole file
+only where sizes and prefixes collide
+'''
+
+MATCH_WORKERS = 8
+# candidates sized per batch, a walk of the folder is not held in memory
+MATCH_BATCH_SIZE = 1024
+FULL_HASH_BLOCK = 2**20
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def full_checksum(path):
+    try:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(FULL_HASH_BLOCK), b''):
+                h.update(block)
+        return h.hexdigest()
+    except OSError:
+        return None
+
+def pool_map(func, paths):
+    '''
+    apply func to the paths on a thread pool
+    Return: list of results, in order
+    '''
+    with ThreadPoolExecutor(max_workers=MATCH_WORKERS) as pool:
+        return list(pool.map(func, paths))
+
+def _full(paths, mapper):
+    # full hashes are only needed beyond the prefix
+    return dict(zip(paths, mapper(full_checksum, paths)))
+
+def match_files(wanted, candidates, mapper=pool_map, size_mapper=None):
+    '''
+    Args:
+        wanted: {key: (size, checksum)}, size is None if unknown
+        candidates: list or iterable (e.g. walk_files) of file paths, consumed batch by batch
+        mapper: mapper(func, paths) -> list of results, pool_map by default
+        size_mapper: mapper of the size stage, called once per batch, mapper by default
+    Return: {key: path}, keys without a match or with ambiguous matches are left out
+    '''
+    if len(wanted) == 0:
+        return {}
+    size_mapper = mapper if size_mapper is None else size_mapper
+    # stage 1: size, only the files of a wanted size are kept
+    known = set(size for size, _ in wanted.values())
+    any_size = None in known
+    candidates, sizes = iter(candidates), {}
+    while True:
+        batch = list(itertools.islice(candidates, MATCH_BATCH_SIZE))
+        if len(batch) == 0:
+            break
+        for path, size in zip(batch, size_mapper(file_size, batch)):
+            if size is not None and (any_size or size in known):
+                sizes[path] = size
+    candidates = list(sizes.keys())
+    # stage 2: prefix checksum
+    by_checksum = {}
+    for path, checksum in zip(candidates, mapper(compute_checksum, candidates)):
+        by_checksum.setdefault(checksum, []).append(path)
+    matches, ambiguous = {}, {}
+    for key, (size, checksum) in wanted.items():
+        paths = [p for p in by_checksum.get(checksum, []) if size is None or sizes[p] == size]
+        if len(paths) == 1:
+            matches[key] = paths[0]
+        elif len(paths) > 1:
+            ambiguous[key] = paths
+    # stage 3: full hash, the missing file is not available, candidates must be identical
+    full = _full(sorted(set(p for paths in ambiguous.values() for p in paths if sizes[p] > CHECKSUM_BYTES)), mapper)
+    for key, paths in ambiguous.items():
+        if len(set(full.get(p) for p in paths)) == 1:
+            matches[key] = paths[0]
+        else:
+            print('WARN: Ambiguous Match, Skipped: ', ', '.join(paths))
+    return matches
+
+def find_duplicates(files, mapper=pool_map):
+    '''
+    Args:
+        files: list of (key, path, size, checksum), path and size may be None for missing files
+        mapper: mapper(func, paths) -> list of results, pool_map by default
+    Return: list of groups of keys with identical content, in the order of files
+    '''
+    # stage 1: stored checksum
+    by_checksum = {}
+    for f in files:
+        if f[3] is not None:
+            by_checksum.setdefault(f[3], []).append(f)
+    candidates = [f for group in by_checksum.values() if len(group) > 1 for f in group]
+    # stage 2: size, from the file if it exists
+    existing = [f[1] for f in candidates if f[1] is not None]
+    sizes = dict(zip(existing, mapper(file_size, existing)))
+    buckets = {}
+    for f in candidates:
+        size = sizes.get(f[1]) if f[1] is not None else None
+        size = f[2] if size is None else size
+        buckets.setdefault((f[3], size), []).append(f)
+    # stage 3: full hash where the prefix does not cover the file
+    escalate = [f[1] for (_, size), group in buckets.items() if len(group) > 1 and size is not None and size > CHECKSUM_BYTES
+                for f in group if f[1] is not None and sizes.get(f[1]) is not None]
+    full = _full(escalate, mapper)
+    groups = []
+    for (_, size), group in buckets.items():
+        if len(group) < 2:
+            continue
+        subgroups = {}
+        for f in group:
+            subgroups.setdefault(full.get(f[1]), []).append(f[0])
+        # files that could not be hashed (missing) stay with the first group of their bucket
+        unverified = subgroups.pop(None, [])
+        subgroups = list(subgroups.values())
+        if len(subgroups) > 0:
+            subgroups[0] = sorted(subgroups[0] + unverified, key=[f[0] for f in group].index)
+        else:
+            subgroups = [unverified]
+        groups += [g for g in subgroups if len(g) > 1]
+    return groups
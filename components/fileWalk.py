@@ -0,0 +1,43 @@
+from fnmatch import fnmatch
+import os
+
+from .enumDef import IMAGE_TYPES
+
+IMAGE_EXTS = [t[1:] for t in IMAGE_TYPES]
+# names of files and directories skipped by default (hidden entries, system folders)
+DEFAULT_EXCLUDE = ['.*', '$RECYCLE.BIN', 'System Volume Information']
+
+def walk_files(folder, exts=IMAGE_EXTS, exclude=DEFAULT_EXCLUDE, max_depth=None):
+    '''
+    visit the directory tree once and yield matching files as they are found,
+    files of a directory come (sorted by name) before its subdirectories,
+    symbolic links to directories are not followed
+    Args:
+        exts: file extensions, matched case-insensitively
+        exclude: glob patterns of file and directory names to skip
+        max_depth: depth of subdirectories visited, 0 for the folder itself only, None for no limit
+    '''
+    exts = tuple(e.lower() for e in exts)
+    exclude = exclude if exclude is not None else []
+    stack = [(folder, 0)]
+    while len(stack) > 0:
+        path, depth = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print('WARN: Directory Not Scanned: ', path, e)
+            continue
+        subdirs = []
+        for entry in entries:
+            if any(fnmatch(entry.name, p) for p in exclude):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if max_depth is None or depth < max_depth:
+                        subdirs.append(entry.path)
+                elif entry.name.lower().endswith(exts) and entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
+        stack += [(d, depth+1) for d in reversed(subdirs)]
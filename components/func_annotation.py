@@ -6,6 +6,7 @@ import numpy as np
 from .enumDef import *
 from .annotations import *
 from .messages import ProgressDiag
+from .annoBinary import read_binary, read_binary_header, save_binary
 
 def read_anno_item_hdf(anno_item):
     anno_type = anno_item.attrs['type']
@@ -89,12 +90,17 @@ def anno_read(anno_path):
     elif os.path.splitext(anno_path)[1] == ANNOTATION_EXT:
         with open(anno_path, mode='r') as f:
             anno = json.load(f)
+    elif os.path.splitext(anno_path)[1] == BINARY_ANNOTATION_EXT:
+        # coordinates are numpy views into one buffer
+        anno = read_binary(anno_path)
     else:
         anno = None
     return anno
 
 def anno_save(anno, anno_path):
 
+    os.makedirs(os.path.dirname(anno_path), exist_ok=True)
+
     if os.path.splitext(anno_path)[1] == '.hdf5':
         with h5py.File(anno_path, 'w') as anno_hdf:
             # save status
@@ -115,21 +121,37 @@ def anno_save(anno, anno_path):
             anno_hdf.flush()
     elif os.path.splitext(anno_path)[1] == ANNOTATION_EXT:
         with open(anno_path, mode='w') as f:
-            json.dump(anno, f)
+            # coordinates read from a binary container are numpy arrays
+            json.dump(anno, f, default=lambda x: x.tolist())
+    elif os.path.splitext(anno_path)[1] == BINARY_ANNOTATION_EXT:
+        save_binary(anno, anno_path)
+
+def anno_convert(anno_path, ext):
+    '''
+    convert an annotation file between json, binary container (and hdf5),
+    the source file is removed
+    Args:
+        ext: ANNOTATION_EXT, BINARY_ANNOTATION_EXT
+    Return: path of the converted file
+    '''
+    new_path = os.path.splitext(anno_path)[0] + ext
+    if new_path != anno_path and os.path.isfile(anno_path):
+        anno_save(anno_read(anno_path), new_path)
+        os.remove(anno_path)
+    return new_path
 
 
 def anno_copy(file1, file2):
     '''
-    copy file2 to file1
+    copy file2 to file1, converted if the formats differ
     '''
     if os.path.isfile(file2):
-        if not os.path.isfile(file1):
-            shutil.copy(file2, file1)
-        elif not os.path.samefile(file1, file2) and os.path.splitext(file1)[1] == os.path.splitext(file2)[1]:
-            shutil.copy(file2, file1)
-        else:
+        os.makedirs(os.path.dirname(file1), exist_ok=True)
+        if os.path.splitext(file1)[1] != os.path.splitext(file2)[1]:
             anno = anno_read(file2)
             anno_save(anno, file1)
+        elif not os.path.isfile(file1) or not os.path.samefile(file1, file2):
+            shutil.copy(file2, file1)
 
 
 def anno_merge(file1, file2):
@@ -185,6 +207,8 @@ def get_status(anno_path):
             with open(anno_path, mode='r') as f:
                 anno = json.load(f)
                 status = anno['status']
+        if ext == BINARY_ANNOTATION_EXT:
+            status = read_binary_header(anno_path)['status']
         return status
 
 
@@ -192,12 +216,10 @@ def set_status(anno_path, status):
     if status in [FINISHED, UNFINISHED, CONFIRMED, PROBLEM]:
         if os.path.isfile(anno_path):
             ext = os.path.splitext(anno_path)[1]
-            if ext == ANNOTATION_EXT:
-                with open(anno_path, "r") as f:
-                    anno_file = json.load(f)
+            if ext == ANNOTATION_EXT or ext == BINARY_ANNOTATION_EXT:
+                anno_file = anno_read(anno_path)
                 anno_file['status'] = status
-                with open(anno_path, "w") as f:
-                    json.dump(anno_file, f)
+                anno_save(anno_file, anno_path)
             if ext == '.hdf5':
                 with h5py.File(anno_path, 'a') as location:
                     if 'status' in location.attrs.keys():
@@ -205,10 +227,9 @@ def set_status(anno_path, status):
 
 def anno_props(anno_path):
     props = {}
-    if os.path.isfile(anno_path):
-        with open(anno_path, mode='r') as f:
-            anno = json.load(f)
-            props = anno['labels']
+    anno = anno_read(anno_path)
+    if anno is not None:
+        props = anno['labels']
     return props
 
 def anno_props(anno_list):
@@ -218,32 +239,30 @@ def anno_props(anno_list):
         progress.show()
     for anno_path in anno_list:
         progress.new_item('Counted: ' + anno_path)
-        if os.path.isfile(anno_path):
-            with open(anno_path, mode='r') as f:
-                anno = json.load(f)
-                for p, lbs in anno['labels'].items():
-                    if p in props.keys():
-                        props[p] = props[p].union(set(lbs))
-                    else: 
-                        props[p] = set(lbs)
+        anno = anno_read(anno_path)
+        if anno is not None:
+            for p, lbs in anno['labels'].items():
+                if p in props.keys():
+                    props[p] = props[p].union(set(lbs))
+                else: 
+                    props[p] = set(lbs)
     return props
 
 
 def anno_report(anno_path):
     total, stats = 0, {}
 
-    if os.path.isfile(anno_path):
-        with open(anno_path, mode='r') as f:
-            anno = json.load(f)
-            total = len(anno['annotations'])
-            for _, anno_item in anno['annotations'].items():
-                for prop, label in anno_item['labels'].items():
-                    if prop not in stats.keys():
-                        stats[prop] = {}
-                    if label not in stats[prop].keys():
-                        stats[prop][label] = 1
-                    else:
-                        stats[prop][label] += 1
+    anno = anno_read(anno_path)
+    if anno is not None:
+        total = len(anno['annotations'])
+        for _, anno_item in anno['annotations'].items():
+            for prop, label in anno_item['labels'].items():
+                if prop not in stats.keys():
+                    stats[prop] = {}
+                if label not in stats[prop].keys():
+                    stats[prop][label] = 1
+                else:
+                    stats[prop][label] += 1
 
     return total, stats
 
@@ -2,19 +2,54 @@ from .enumDef import *
 from PIL import Image
 import numpy as np
 import math
+import os
+import json
 import cv2
 from .func_annotation import anno_read
-
-
-def export_mask(anno_path, img_path, export_labels=None, save_as_one=True):
+from .image import image_meta
+
+
+def image_size(img_path, meta=None):
+    '''
+    Args:
+        meta: image metadata from the project index, the image header is read if None
+    Return: width, height, channels
+    '''
+    if meta is None:
+        meta = image_meta(img_path)
+    return meta['width'], meta['height'], meta['channels']
+
+def sparse_mask(pts, value, width, height):
+    '''
+    rasterize a polygon only inside its bounding box (clipped to the image)
+    Return: (crop, x, y, height, width), the crop placed at (x, y) in an image of height x width
+    '''
+    pts = np.array(pts).astype(np.int32).reshape((-1, 2))
+    x0, y0 = max(int(pts[:,0].min()), 0), max(int(pts[:,1].min()), 0)
+    x1, y1 = min(int(pts[:,0].max())+1, width), min(int(pts[:,1].max())+1, height)
+    crop = np.zeros((max(y1-y0, 0), max(x1-x0, 0)), np.uint8)
+    if crop.size > 0:
+        cv2.fillPoly(crop, np.expand_dims(pts - [x0, y0], 0), value)
+    return crop, x0, y0, height, width
+
+def dense_mask(sparse):
+    '''
+    expand a sparse mask to the full image size
+    '''
+    crop, x, y, height, width = sparse
+    mask = np.zeros((height, width), crop.dtype)
+    mask[y:y+crop.shape[0], x:x+crop.shape[1]] = crop
+    return mask
+
+
+def export_mask(anno_path, img_path, export_labels=None, save_as_one=True, meta=None):
 
     anno_file = anno_read(anno_path)
-    image = Image.open(img_path)
-    width, height = image.size
+    width, height, _ = image_size(img_path, meta)
+    # one mask per object is kept sparse, expanded when written
     if save_as_one:
         mask = np.zeros((height, width), np.uint16)
     else:
-        mask_tmp = np.zeros((height, width), np.uint8)
         mask = []
     if export_labels is not None:
         label_lookup = {}
@@ -42,26 +77,23 @@ def export_mask(anno_path, img_path, export_labels=None, save_as_one=True):
                 if save_as_one:
                     cv2.fillPoly(mask, pts.astype(np.int32), count)
                 else:
-                    mask_tmp = mask_tmp * 0
-                    cv2.fillPoly(mask_tmp, pts.astype(np.int32), 255)
-                    mask.append(mask_tmp.copy())
+                    mask.append(sparse_mask(pts, 255, width, height))
         else:
             print('Mask Export: ' + anno_type + ' not supported')
     
     return mask, count == 0
 
-def export_semantic(anno_path, img_path, category, labels, export_undefined=False, save_as_one=True):
+def export_semantic(anno_path, img_path, category, labels, export_undefined=False, save_as_one=True, meta=None):
 
     if export_undefined:
         lb_undefined = max(list(labels.values())) + 1 
 
     anno_file = anno_read(anno_path)
-    image = Image.open(img_path)
-    width, height = image.size
+    width, height, _ = image_size(img_path, meta)
+    # one mask per object is kept sparse, expanded when written
     if save_as_one:
         mask = np.zeros((height, width), np.uint8)
     else:
-        mask_tmp = np.zeros((height, width), np.uint8)
         mask = []
 
     count = 0
@@ -87,9 +119,7 @@ def export_semantic(anno_path, img_path, category, labels, export_undefined=Fals
                 if save_as_one:
                     cv2.fillPoly(mask, pts.astype(np.int32), lb)
                 else:
-                    mask_tmp = mask_tmp * 0
-                    cv2.fillPoly(mask_tmp, pts.astype(np.int32), lb)
-                    mask.append(mask_tmp.copy())
+                    mask.append(sparse_mask(pts, lb, width, height))
         else:
             print('Mask Export: ' + anno_type + ' not supported')
 
@@ -127,7 +157,7 @@ def export_bbx(anno_path, img_path, category=None, labels={}, export_undefined=F
     return annoList, count == 0
 
 
-def createXml(AnnoList, img_path, save_name):
+def createXml(AnnoList, img_path, save_name, meta=None):
     """
     :param AnnoList: include 'name' and 'bndbox'.
     e.g:
@@ -150,19 +180,19 @@ def createXml(AnnoList, img_path, save_name):
 
     # image size
     # image = cv2.imread(img_path)
-    image = Image.open(img_path)
+    width, height, depth = image_size(img_path, meta)
     imgSize = doc.createElement('size')
 
     imgWidth = doc.createElement('width')
-    imgWidth.appendChild(doc.createTextNode(str(image.width)))
+    imgWidth.appendChild(doc.createTextNode(str(width)))
     imgSize.appendChild(imgWidth)
 
     imgHeight = doc.createElement('height')
-    imgHeight.appendChild(doc.createTextNode(str(image.height)))
+    imgHeight.appendChild(doc.createTextNode(str(height)))
     imgSize.appendChild(imgHeight)
 
     imgDepth = doc.createElement('depth')
-    imgDepth.appendChild(doc.createTextNode(str(len(image.getbands()))))
+    imgDepth.appendChild(doc.createTextNode(str(depth)))
     imgSize.appendChild(imgDepth)
 
     root.appendChild(imgSize)
@@ -203,6 +233,159 @@ def createXml(AnnoList, img_path, save_name):
     fp.close()
 
 
+def polygon_stats(polygons):
+    '''
+    areas (shoelace formula) and bounding boxes of many polygons in one vectorized pass
+    Args:
+        polygons: list of (N, 2) arrays, N > 0
+    Return: areas (n,), bounding boxes (n, 4) as x, y, width, height
+    '''
+    if len(polygons) == 0:
+        return np.zeros((0,)), np.zeros((0, 4))
+    lengths = np.array([len(pts) for pts in polygons])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    pts = np.concatenate(polygons).astype(np.float64)
+    # the next vertex of each vertex, wrapping around inside each polygon
+    nxt = np.arange(len(pts)) + 1
+    nxt[starts + lengths - 1] = starts
+    cross = pts[:,0] * pts[nxt,1] - pts[nxt,0] * pts[:,1]
+    areas = np.abs(np.add.reduceat(cross, starts)) / 2
+    mins, maxs = np.minimum.reduceat(pts, starts, axis=0), np.maximum.reduceat(pts, starts, axis=0)
+    return areas, np.concatenate([mins, maxs - mins], axis=1)
+
+def rle_encode(sparse):
+    '''
+    uncompressed COCO run-length encoding (column major) of a sparse mask, without expanding it
+    Return: {'counts': [...], 'size': [height, width]}
+    '''
+    crop, x, y, height, width = sparse
+    # column major positions of the object pixels in the full image, ascending
+    idx = np.flatnonzero(crop.T)
+    pos = (idx // max(crop.shape[0], 1) + x) * height + idx % max(crop.shape[0], 1) + y
+    if len(pos) == 0:
+        return {'counts': [height * width], 'size': [height, width]}
+    breaks = np.flatnonzero(np.diff(pos) != 1)
+    starts = np.concatenate([pos[:1], pos[breaks+1]])
+    ends = np.concatenate([pos[breaks]+1, pos[-1:]+1])
+    counts = np.empty(2*len(starts)+1, np.int64)
+    counts[0] = starts[0]
+    counts[1::2] = ends - starts
+    counts[2:-1:2] = starts[1:] - ends[:-1]
+    counts[-1] = height * width - ends[-1]
+    counts = counts if counts[-1] > 0 else counts[:-1]
+    return {'counts': counts.tolist(), 'size': [height, width]}
+
+def export_coco(anno_path, img_path, category, labels, export_undefined=False, rle=False, meta=None):
+    '''
+    COCO objects of the polygons of one image, ids are assigned by the writer
+    Args:
+        labels: {label: category id}
+        rle: encode masks as run-length encoding, otherwise polygons
+    Return: list of objects, width, height
+    '''
+    if export_undefined:
+        lb_undefined = max(list(labels.values())) + 1 
+
+    anno_file = anno_read(anno_path)
+    width, height, _ = image_size(img_path, meta)
+
+    polygons, category_ids = [], []
+    for _, anno in anno_file['annotations'].items():
+        if anno['type'] == POLYGON:
+            lb = lb_undefined if export_undefined else None
+            if category in anno['labels'] and anno['labels'][category] in labels.keys():
+                lb = labels[anno['labels'][category]]
+            if lb is not None and len(anno['coords']) > 0:
+                polygons.append(np.array(anno['coords']).reshape((-1, 2)))
+                category_ids.append(lb)
+        else:
+            print('COCO Export: ' + anno['type'] + ' not supported')
+
+    areas, bboxes = polygon_stats(polygons)
+    # boxes are clipped to the image, as the masks are
+    corners = np.concatenate([bboxes[:,:2], bboxes[:,:2] + bboxes[:,2:]], axis=1)
+    corners = np.clip(corners, 0, [width, height, width, height])
+    bboxes = np.concatenate([corners[:,:2], corners[:,2:] - corners[:,:2]], axis=1)
+    objects = []
+    for pts, lb, area, bbox in zip(polygons, category_ids, areas, bboxes):
+        if rle:
+            mask = sparse_mask(pts, 1, width, height)
+            segmentation = rle_encode(mask)
+            # the area of the encoded mask, not of the polygon
+            area = mask[0].sum()
+        else:
+            segmentation = [pts.reshape(-1).tolist()]
+        objects.append({'category_id': lb,
+                        'segmentation': segmentation,
+                        'area': float(area),
+                        'bbox': bbox.tolist(),
+                        'iscrowd': 0})
+    return objects, width, height
+
+def coco_image_root(paths):
+    '''
+    Return: the deepest folder containing all images, None if there is none (e.g. different drives)
+    '''
+    if len(paths) == 0:
+        return None
+    try:
+        return os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+    except ValueError:
+        return None
+
+def coco_file_name(path, root):
+    '''
+    Return: the image path relative to the image root, the base name if there is no root
+    '''
+    name = os.path.relpath(os.path.abspath(path), root) if root is not None else os.path.basename(path)
+    return name.replace('\\', '/')
+
+class CocoWriter(object):
+
+    """
+    write a COCO json file in chunks: the objects are streamed as they come,
+    only the (small) image entries are kept until the file is closed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+        self.file.write('{"annotations": [')
+        self.images = []
+        self.count = 0
+
+    def add_image(self, file_name, width, height, objects):
+        '''
+        Return: id of the image
+        '''
+        image_id = len(self.images) + 1
+        self.images.append({'id': image_id, 'file_name': file_name, 'width': width, 'height': height})
+        chunk = []
+        for obj in objects:
+            self.count += 1
+            obj = dict(obj, id=self.count, image_id=image_id)
+            chunk.append(json.dumps(obj))
+        if len(chunk) > 0:
+            self.file.write((',\n' if self.count > len(chunk) else '\n') + ',\n'.join(chunk))
+        return image_id
+
+    def close(self, categories):
+        '''
+        Args:
+            categories: {category id: name}
+        '''
+        self.file.write('\n],\n"images": ')
+        json.dump(self.images, self.file)
+        self.file.write(',\n"categories": ')
+        json.dump([{'id': k, 'name': v, 'supercategory': ''} for k, v in sorted(categories.items())], self.file)
+        self.file.write('}\n')
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.path)
+
+
 def extract_patch(anno_path, img_path, padding=0, export_labels=None):
 
     anno_file = anno_read(anno_path)
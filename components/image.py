@@ -1,19 +1,221 @@
 import cv2
 import os
+import stat
 from PyQt5.QtGui import QImage
 import numpy as np
 import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+FRAME_CACHE_SIZE = 16
+# the checksum covers the first bytes of a file
+CHECKSUM_BYTES = 524288
+
+def _hash_file(file):
+    f = open(file, "rb") # opening for [r]eading as [b]inary
+    data = f.read(CHECKSUM_BYTES) # read the first 2**19 bytes
+    f.close()
+    return hashlib.sha256(data).hexdigest()
+
+class ChecksumCache(object):
+
+    """
+    checksums keyed by path, an entry is valid while the file has the same (size, mtime_ns, inode),
+    thread safe, the open project loads and persists the entries in its index
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = set()
+
+    def checksum(self, file):
+        try:
+            st = os.stat(file)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        path = os.path.abspath(file)
+        key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        checksum = _hash_file(file)
+        with self.lock:
+            self.entries[path] = (key, checksum)
+            self.changed.add(path)
+        return checksum
+
+    def update(self, entries):
+        '''
+        Args:
+            entries: iterable of (path, size, mtime_ns, inode, checksum)
+        '''
+        with self.lock:
+            for path, size, mtime_ns, inode, checksum in entries:
+                self.entries[path] = ((size, mtime_ns, inode), checksum)
+
+    def take_changed(self):
+        '''
+        Return: entries computed since the last call, as (path, size, mtime_ns, inode, checksum)
+        '''
+        with self.lock:
+            changed = [(path,) + self.entries[path][0] + (self.entries[path][1],) for path in self.changed]
+            self.changed.clear()
+        return changed
+
+CHECKSUM_CACHE = ChecksumCache()
 
 def compute_checksum(file):
+    return CHECKSUM_CACHE.checksum(file)
+
+# numpy dtype of the PIL image modes
+PIL_DTYPES = {'1': 'bool', 'I;16': 'uint16', 'I;16B': 'uint16', 'I;16L': 'uint16', 'I': 'int32', 'F': 'float32'}
 
-    if os.path.isfile(file):
-        f = open(file, "rb") # opening for [r]eading as [b]inary
-        data = f.read(524288) # read the first 2**9 bytes
-        f.close()
-        return hashlib.sha256(data).hexdigest()
-    else:
+def image_meta(path):
+    '''
+    read the image header, pixels are not decoded
+    Return: {'width', 'height', 'channels', 'frames', 'dtype'}, None if the image can not be read
+    '''
+    from PIL import Image as PILImage
+    try:
+        with PILImage.open(path) as image:
+            return {'width': image.width,
+                    'height': image.height,
+                    'channels': len(image.getbands()),
+                    'frames': getattr(image, 'n_frames', 1),
+                    'dtype': PIL_DTYPES.get(image.mode, 'uint8')}
+    except (OSError, ValueError) as e:
+        print('WARN: Image Header Not Read: ', path, e)
         return None
 
+def normalize_frame(frame):
+    '''
+    squeeze a decoded frame, drop alpha/second channel and convert BGR to RGB
+    '''
+    frame = np.squeeze(frame)
+    if len(frame.shape) == 3:
+        if frame.shape[-1] == 4:
+            frame = frame[...,:3]
+        elif frame.shape[-1] == 2:
+            frame = frame[...,0]
+    if len(frame.shape) == 3:
+        frame = np.flip(frame, 2)
+    return frame
+
+def count_pages(path):
+    if hasattr(cv2, 'imcount'):
+        return cv2.imcount(path)
+    # opencv 3 fallback: PIL only parses the page headers
+    from PIL import Image as PILImage
+    with PILImage.open(path) as im:
+        return getattr(im, 'n_frames', 1)
+
+def read_page(path, idx):
+    '''
+    decode a single page of a multi-page image, returns None on failure
+    '''
+    if hasattr(cv2, 'imcount'):
+        ret, frames = cv2.imreadmulti(path, idx, 1, flags=cv2.IMREAD_UNCHANGED | cv2.IMREAD_ANYDEPTH)
+        if not ret or len(frames) == 0:
+            return None
+        return frames[0]
+    # opencv 3 has no start/count arguments, decode the page with PIL
+    from PIL import Image as PILImage
+    with PILImage.open(path) as im:
+        im.seek(idx)
+        frame = np.array(im)
+    # PIL gives RGB(A), keep the BGR(A) convention of cv2 for normalize_frame, alpha stays last
+    if len(frame.shape) == 3 and frame.shape[-1] >= 3:
+        frame = np.concatenate([frame[..., 2::-1], frame[..., 3:]], axis=2)
+    return frame
+
+
+class FrameStack(object):
+
+    """
+    paged reader of a multi-page image (tiff stack), 
+    frames are decoded on demand and kept in a bounded LRU cache,
+    the intensity range of the stack is computed in a background thread
+    """
+
+    def __init__(self, path, cache_size=FRAME_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.length = count_pages(path)
+        self.mmax, self.mmin = None, None
+        self.stats_ready = False
+        self._stop = threading.Event()
+        self._stats_thread = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.length
+        if idx < 0 or idx >= self.length:
+            raise IndexError('frame index out of range')
+        with self.lock:
+            if idx in self.cache:
+                self.cache.move_to_end(idx)
+                return self.cache[idx]
+        frame = read_page(self.path, idx)
+        frame = normalize_frame(frame) if frame is not None else None
+        if frame is None:
+            raise IOError('cannot decode frame {} of {}'.format(idx, self.path))
+        with self.lock:
+            self.cache[idx] = frame
+            self.cache.move_to_end(idx)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        if self.mmax is None:
+            self.mmax, self.mmin = frame.max(), frame.min()
+        return frame
+
+    def start_stats(self):
+        '''
+        compute the intensity range over all frames in background,
+        the range of the decoded frames is used until it is finished
+        '''
+        if self._stats_thread is None:
+            self._stats_thread = threading.Thread(target=self._compute_stats, daemon=True)
+            self._stats_thread.start()
+
+    def _compute_stats(self):
+        start = time.time()
+        mmax, mmin = None, None
+        for idx in range(self.length):
+            if self._stop.is_set():
+                return
+            with self.lock:
+                frame = self.cache.get(idx)
+            if frame is None:
+                frame = read_page(self.path, idx)
+                if frame is None:
+                    continue
+                frame = normalize_frame(frame)
+            fmax, fmin = frame.max(), frame.min()
+            mmax = fmax if mmax is None else max(mmax, fmax)
+            mmin = fmin if mmin is None else min(mmin, fmin)
+        if mmax is not None:
+            self.mmax, self.mmin = mmax, mmin
+        self.stats_ready = True
+        print('INFO: Stack Statistics ({} Frames) Computed in {} Seconds'.format(self.length, time.time()-start))
+
+    def range(self):
+        return self.mmax, self.mmin
+
+    def close(self):
+        self._stop.set()
+        with self.lock:
+            self.cache.clear()
+
 class Image(object):
 
     def __init__(self):
@@ -23,6 +225,7 @@ class Image(object):
         self.data = []
         self.height, self.width = None, None
         self.disp = None
+        self.mmax, self.mmin = None, None
         self.auto_contrast = False
         # self.checksum = None 
         self.image_open = False
@@ -39,39 +242,50 @@ class Image(object):
         # self.data = cv2.imdecode(numpyarray, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
         _, ext = os.path.splitext(path)
         if ext in ['.tif', '.tiff']:
-            self.data = cv2.imreadmulti(path, flags=cv2.IMREAD_UNCHANGED | cv2.IMREAD_ANYDEPTH)[1]
+            # frames of a stack are decoded on demand
+            self.data = FrameStack(path)
+            try:
+                first = self.data[0] if len(self.data) > 0 else None
+            except IOError:
+                first = None
+            if first is None:
+                self.data.close()
+                self.data = []
         elif ext in ['.avi', '.mp4']:
             pass
         else:
             self.data = cv2.imread(path, cv2.IMREAD_UNCHANGED | cv2.IMREAD_ANYDEPTH)
-            self.data = [self.data] if self.data is not None else []
-        self.data = [np.squeeze(f) for f in self.data]
+            self.data = [normalize_frame(self.data)] if self.data is not None else []
 
         # for f in self.data:
         #     print(f.shape, f.dtype)
         
         if len(self.data) > 0:
-            if len(self.data[0].shape) == 3:
-                if self.data[0].shape[-1] == 4:
-                    self.data = [im[...,:3] for im in self.data]
-                elif self.data[0].shape[-1] == 2:
-                    self.data = [im[...,0] for im in self.data]
-                self.data = [np.flip(im, 2) for im in self.data]
+            frame = self.data[0]
             self.path = path
             self.filename = os.path.basename(path)
-            self.height, self.width = self.data[0].shape[0], self.data[0].shape[1]
-            self.mmax, self.mmin = np.max(self.data), np.min(self.data)
-            self.disp = self.data[0]
+            self.height, self.width = frame.shape[0], frame.shape[1]
+            if isinstance(self.data, FrameStack):
+                self.data.start_stats()
+            self.mmax, self.mmin = np.max(frame), np.min(frame)
+            self.disp = frame
             self.auto_contrast = False
             # self.checksum = None
             self.image_open = True
     
+    def _update_disp(self):
+        frame = self.data[self.idx]
+        if isinstance(self.data, FrameStack):
+            mmax, mmin = self.data.range()
+            if mmax is not None:
+                self.mmax, self.mmin = mmax, mmin
+        # converted for display by to_disp8, no full size copy is kept
+        self.disp = frame
+
     def next(self):
         if len(self.data) > 0:
             self.idx = self.idx + 1 if self.idx < len(self.data)-1 else 0
-            self.disp = self.data[self.idx]
-            if self.auto_contrast:
-                self.disp = ((self.data[self.idx]-self.mmin)/(self.mmax-self.mmin)*255).astype(np.uint8)
+            self._update_disp()
             return True
         else:
             return False
@@ -79,13 +293,15 @@ class Image(object):
     def last(self):
         if len(self.data) > 0:
             self.idx = self.idx - 1 if self.idx > 0 else len(self.data) - 1
-            self.disp = self.data[self.idx]
+            self._update_disp()
             return True
         else:
             return False
             
     
     def close(self):
+        if isinstance(self.data, FrameStack):
+            self.data.close()
         self.path = None
         self.filename = None
         self.data = []
@@ -101,15 +317,35 @@ class Image(object):
             if self.auto_contrast is False and auto_contrast:
                 # data_sub = self.data[::16,::16]
                 # mmin, mmax = data_sub.min(), data_sub.max()
-                self.disp = ((self.data[self.idx]-self.mmin)/(self.mmax-self.mmin)*255).astype(np.uint8)
                 self.auto_contrast = True
+                self._update_disp()
             if self.auto_contrast and auto_contrast is False:
-                self.disp = self.data[self.idx]
                 self.auto_contrast = False
+                self._update_disp()
+
+    def disp_key(self):
+        '''
+        Return: a key of the display array, equal keys give the same display
+        '''
+        if self.is_open():
+            contrast = (float(self.mmin), float(self.mmax)) if self.auto_contrast else None
+            return (self.path, self.idx, contrast)
+
+    def to_disp8(self, region):
+        '''
+        uint8 display values of (a region of) the current frame, with the contrast applied
+        '''
+        if self.auto_contrast:
+            return ((region-self.mmin)/(self.mmax-self.mmin)*255).astype(np.uint8)
+        return (region/255).astype(np.uint8) if region.dtype == 'uint16' else region
+
+    def get_disp8(self):
+        if self.is_open():
+            return self.to_disp8(self.disp)
 
     def get_QImage(self):
         if self.is_open():
-            disp = (self.disp/255).astype(np.uint8) if self.disp.dtype == 'uint16' else self.disp
+            disp = self.get_disp8()
             # print(disp.shape, disp.dtype)
             if len(disp.shape) == 2:
                 disp = cv2.cvtColor(disp,cv2.COLOR_GRAY2RGB) 
@@ -126,10 +362,11 @@ class Image(object):
 
     def get_gray(self):
         if self.is_open():
-            if len(self.data.shape) == 3:
-                return cv2.cvtColor(self.data, cv2.COLOR_RGB2GRAY)
+            frame = self.data[self.idx]
+            if len(frame.shape) == 3:
+                return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
             else:
-                return self.data
+                return frame
 
     def checksum(self):
         if self.is_open():
@@ -0,0 +1,174 @@
+import json
+import os
+
+from .enumDef import *
+from .annoBinary import read_binary
+
+# suffix of a journal whose operations are being written into the snapshot
+COMPACTING_EXT = '.compacting'
+# compacted unsaved edits, a snapshot next to the annotation file, which keeps the last saved state
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+def journal_path(annotation_path):
+    return os.path.splitext(annotation_path)[0] + JOURNAL_EXT
+
+def checkpoint_path(annotation_path):
+    # same extension, the snapshot is written and read like the annotation file
+    name, ext = os.path.splitext(annotation_path)
+    return name + CHECKPOINT_SUFFIX + ext
+
+def read_ops(annotation_path):
+    '''
+    Return: the journaled operations of the annotation file, in order
+    '''
+    path = journal_path(annotation_path)
+    ops = []
+    for p in [path + COMPACTING_EXT, path]:
+        if not os.path.isfile(p):
+            continue
+        with open(p, 'r') as f:
+            for line in f:
+                try:
+                    ops.append(json.loads(line))
+                except ValueError:
+                    # the last line may be incomplete after a crash
+                    break
+    return ops
+
+def replay(anno_file, annotation_path, ops=None):
+    '''
+    apply the journaled operations to a parsed annotation file (in place),
+    operations set states, so replaying onto a newer snapshot gives the same result
+    Args:
+        anno_file: {'status': ..., 'labels': ..., 'annotations': ...}
+        ops: operations read before, by read_ops, the journal is read if None
+    Return: number of operations applied
+    '''
+    ops = read_ops(annotation_path) if ops is None else ops
+    for op in ops:
+        _apply(anno_file, op)
+    return len(ops)
+
+def _apply(anno_file, op):
+    annotations = anno_file['annotations']
+    if op['op'] == 'add':
+        annotations[op['timestamp']] = op['annotation']
+    elif op['op'] == 'remove':
+        annotations.pop(op['timestamp'], None)
+    elif op['op'] == 'assign':
+        labels = anno_file['labels'].setdefault(op['property'], {})
+        if op['label'] not in labels:
+            labels[op['label']] = op['color']
+        if op['timestamp'] in annotations:
+            annotations[op['timestamp']].setdefault('labels', {})[op['property']] = op['label']
+    elif op['op'] == 'withdraw':
+        if op['timestamp'] in annotations:
+            labels = annotations[op['timestamp']].get('labels', {})
+            if labels.get(op['property']) == op['label']:
+                del labels[op['property']]
+
+def _read(path):
+    if os.path.splitext(path)[1] == BINARY_ANNOTATION_EXT:
+        return read_binary(path, as_list=True)
+    with open(path, mode='r') as f:
+        return json.load(f)
+
+def load_with_journal(annotation_path, ops=None):
+    '''
+    the checkpoint of compacted edits is read instead of the annotation file if there is one
+    Args:
+        ops: journaled operations read before, the journal is read if None
+    Return: the annotation file with the journal replayed, number of replayed operations, whether a checkpoint was read
+    '''
+    checkpoint = checkpoint_path(annotation_path)
+    if os.path.isfile(checkpoint):
+        anno_file = _read(checkpoint)
+    elif os.path.isfile(annotation_path):
+        anno_file = _read(annotation_path)
+    else:
+        anno_file = {'status': UNFINISHED, 'labels': {}, 'annotations': {}}
+    return anno_file, replay(anno_file, annotation_path, ops), os.path.isfile(checkpoint)
+
+
+class Journal(object):
+
+    """
+    append-only log of the edits of the current annotation file, one json object per line,
+    the log is rotated when a snapshot (the annotation file or the checkpoint) is saved and removed once the snapshot is written
+    """
+
+    def __init__(self):
+        self.path = None
+        self.checkpoint = None
+        self.file = None
+        self.count = 0
+
+    def open(self, annotation_path):
+        self.close()
+        self.path = journal_path(annotation_path)
+        self.checkpoint = checkpoint_path(annotation_path)
+        self.count = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.path = None
+        self.checkpoint = None
+        self.count = 0
+
+    def record(self, op):
+        '''
+        Args:
+            op: dict with key 'op' in 'add', 'remove', 'assign', 'withdraw'
+        '''
+        if self.path is None:
+            return
+        try:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, 'a')
+            self.file.write(json.dumps(op) + '\n')
+            self.file.flush()
+            self.count += 1
+        except OSError as e:
+            print('WARN: Edit Not Journaled: ', e)
+
+    def rotate(self):
+        '''
+        move the journal aside before a snapshot is saved
+        Return: the moved journal, to be removed when the snapshot is written, or None
+        '''
+        if self.path is None:
+            return None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.count = 0
+        if not os.path.isfile(self.path):
+            return None
+        rotated = self.path + COMPACTING_EXT
+        if os.path.isfile(rotated):
+            # a previous snapshot failed, keep its operations in order
+            with open(rotated, 'a') as dst, open(self.path, 'r') as src:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, rotated)
+        return rotated
+
+    def discard(self):
+        '''
+        drop the edits made since the annotation file was saved
+        '''
+        if self.path is not None:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            # a rotated journal of a failed snapshot and the checkpoint hold unsaved edits as well
+            for p in [self.path, self.path + COMPACTING_EXT, self.checkpoint]:
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+            self.count = 0
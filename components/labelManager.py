@@ -6,6 +6,8 @@ class LabelManager(Table):
     def __init__(self, config, label_dict=None):
         super().__init__()
         self.config = config
+        # record(op) of the annotation manager, label edits are journaled if set
+        self.record = None
 
     #######################################
     #### parse / render save structure ####
@@ -232,6 +234,7 @@ class Label(Table):
             self[anno.timestamp] = anno
             if not saved:
                 self.property.labelMgr.config.saved = False
+                self._journal('assign', anno.timestamp)
 
     def withdraw(self, anno, saved=False):
         '''
@@ -246,6 +249,13 @@ class Label(Table):
             del self[timestamp]
             if not saved:
                 self.property.labelMgr.config.saved = False
+                self._journal('withdraw', timestamp)
+
+    def _journal(self, op, timestamp):
+        record = self.property.labelMgr.record
+        if record is not None:
+            record({'op': op, 'timestamp': timestamp, 'property': self.property.name, 
+                            'label': self.name, 'color': [int(c) for c in self.color]})
 
     def withdraw_all(self, saved=False):
         for _, anno in self.items():
@@ -1,19 +1,228 @@
 from skimage.filters import sobel
 from skimage.draw import disk
 from scipy import ndimage
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 from .image import Image
+from collections import OrderedDict
 import cv2
 import numpy as np
 import math
-import heapq
 import time
+import threading
+import os
 
-def gradient_cost(img):
+# lazy mode: the first expansion radius and the margin kept beyond the cursor
+LAZY_MIN_RADIUS = 16
+LAZY_MARGIN = 1.5
+
+COST_CACHE_SIZE = 256
+# bytes of gradient tiles kept in the cache directory, the least recently used (by mtime) are removed beyond it
+COST_CACHE_DISK_BUDGET = 2**30
+# a cleanup removes tiles until this fraction of the budget is used
+COST_CACHE_DISK_KEEP = 0.8
+# gradient tiles (computational scale) and the margin needed by blur and sobel
+COST_TILE_SIZE = 256
+COST_TILE_MARGIN = 8
+
+NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+def gradient_map(img):
+    img = cv2.GaussianBlur(img, (11,11), 1)
     G = sobel(img)
     # dx = cv2.Sobel(img,cv2.CV_32F,1,0,ksize=3)
     # dy = cv2.Sobel(img,cv2.CV_32F,0,1,ksize=3)
     # G = (dx ** 2 + dy ** 2) ** 0.5
-    return 1-G/G.max()
+    return G
+
+def shortest_path_tree(cost_roi, seed, radius):
+    '''
+    Dijkstra on the 8-neighbour graph inside the disk around the seed,
+    moving to a pixel n costs cost_roi[n] times the step length
+    Args:
+        cost_roi: cost map of shape (h, w) covering the disk
+        seed: coordinate tuple (x, y) in cost_roi
+        radius: paths are restricted to the disk of this radius
+    Return: 
+        previous: (h, w) flat index (in cost_roi) of the predecessor of each pixel, -1 if not reached
+        cost: (h, w) accumulated cost, inf if not reached
+    '''
+    h, w = cost_roi.shape
+    # nodes of the graph: pixels of the disk
+    inside = np.zeros((h, w), dtype=bool)
+    rr, cc = disk((seed[1], seed[0]), radius, shape=(h, w))
+    inside[rr, cc] = True
+    index = np.arange(h*w).reshape(h, w)
+    # edges: one vectorized pass per neighbour offset
+    src, dst, weight = [], [], []
+    for dy, dx in NEIGHBORS:
+        s_rows, d_rows = slice(max(0, -dy), h-max(0, dy)), slice(max(0, dy), h-max(0, -dy))
+        s_cols, d_cols = slice(max(0, -dx), w-max(0, dx)), slice(max(0, dx), w-max(0, -dx))
+        valid = inside[s_rows, s_cols] & inside[d_rows, d_cols]
+        src.append(index[s_rows, s_cols][valid])
+        dst.append(index[d_rows, d_cols][valid])
+        weight.append(cost_roi[d_rows, d_cols][valid] * math.sqrt(dy**2+dx**2))
+    graph = csr_matrix((np.concatenate(weight), (np.concatenate(src), np.concatenate(dst))), shape=(h*w, h*w))
+    cost, previous = dijkstra(graph, directed=True, indices=seed[1]*w+seed[0], return_predecessors=True)
+    previous[previous < 0] = -1
+    return previous.reshape(h, w), cost.reshape(h, w)
+
+def gradient_max(gray, strip=COST_TILE_SIZE, margin=COST_TILE_MARGIN):
+    '''
+    maximum of the gradient map of the whole image, computed in strips with the margin of the tiles,
+    so it is the maximum over all gradient tiles, whichever of them are computed later
+    '''
+    H, g_max = gray.shape[0], 0
+    for y0 in range(0, H, strip):
+        my0, my1 = max(0, y0-margin), min(H, y0+strip+margin)
+        G = gradient_map(gray[my0:my1])
+        # in float32 as the tiles, no cost is negative
+        g_max = max(g_max, float(G[y0-my0:min(y0+strip, H)-my0].astype(np.float32).max()))
+    return g_max
+
+class CostMapCache(object):
+
+    """
+    cache of livewire gradient tiles keyed by (image checksum, scale, frame, tile row, tile col),
+    an in-memory LRU of tiles in front of memory-mapped .npy files in the cache directory,
+    the files are bounded by a disk budget, the least recently used are removed first
+    """
+
+    def __init__(self, cache_dir=None, size=COST_CACHE_SIZE, disk_budget=COST_CACHE_DISK_BUDGET):
+        self.cache_dir = None
+        self.size = size
+        self.disk_budget = disk_budget
+        self.maps = OrderedDict()
+        # gradient maxima by (image checksum, scale, frame), few and small
+        self.maxima = {}
+        # bytes of tile files in the cache directory, None until scanned
+        self.disk_usage = None
+        self.lock = threading.Lock()
+        self.set_dir(cache_dir)
+
+    def set_dir(self, cache_dir):
+        '''
+        Args:
+            cache_dir: directory of the .npy store, None keeps the cache in memory only
+        '''
+        if cache_dir != self.cache_dir:
+            with self.lock:
+                self.disk_usage = None
+        self.cache_dir = cache_dir
+
+    def _tile_files(self):
+        '''
+        Return: list of (mtime, size, path) of the tile files in the cache directory
+        '''
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.startswith('grad_') and entry.name.endswith('.npy'):
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        files.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass
+        return files
+
+    def _account(self, size):
+        '''
+        add a written tile to the disk usage, remove the least recently used tiles beyond the budget
+        '''
+        with self.lock:
+            if self.disk_usage is None:
+                self.disk_usage = sum(f[1] for f in self._tile_files())
+            else:
+                self.disk_usage += size
+            if self.disk_budget is None or self.disk_usage <= self.disk_budget:
+                return
+            files = sorted(self._tile_files())
+            usage = sum(f[1] for f in files)
+            for _, fsize, path in files:
+                if usage <= self.disk_budget * COST_CACHE_DISK_KEEP:
+                    break
+                try:
+                    os.remove(path)
+                    usage -= fsize
+                except OSError:
+                    # e.g. still mapped on windows
+                    continue
+            self.disk_usage = usage
+
+    def _file(self, key):
+        return os.path.join(self.cache_dir, 'grad_{}_{:.6g}_{}_{}_{}.npy'.format(*key))
+
+    def get(self, key):
+        if key in self.maps:
+            self.maps.move_to_end(key)
+            return self.maps[key]
+        if self.cache_dir is not None and key[0] is not None:
+            path = self._file(key)
+            if os.path.isfile(path):
+                try:
+                    cost = np.load(path, mmap_mode='r')
+                    # the mtime orders the tiles for removal
+                    os.utime(path)
+                except (ValueError, OSError):
+                    return None
+                self._remember(key, cost)
+                return cost
+        return None
+
+    def _max_file(self, status):
+        return os.path.join(self.cache_dir, 'gmax_{}_{:.6g}_{}.npy'.format(*status))
+
+    def get_max(self, status):
+        '''
+        Return: the gradient maximum of (image checksum, scale, frame), None if not cached
+        '''
+        if status in self.maxima:
+            return self.maxima[status]
+        if self.cache_dir is not None and status[0] is not None and os.path.isfile(self._max_file(status)):
+            try:
+                self.maxima[status] = float(np.load(self._max_file(status)))
+            except (ValueError, OSError):
+                return None
+            return self.maxima[status]
+        return None
+
+    def put_max(self, status, g_max):
+        self.maxima[status] = g_max
+        if self.cache_dir is not None and status[0] is not None:
+            try:
+                if not os.path.exists(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                path = self._max_file(status)
+                with open(path + '.tmp', 'wb') as f:
+                    np.save(f, np.float64(g_max))
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                print('WARN: Gradient Maximum Not Cached: ', e)
+
+    def put(self, key, cost):
+        self._remember(key, cost)
+        if self.cache_dir is not None and key[0] is not None:
+            try:
+                if not os.path.exists(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                path = self._file(key)
+                # write to a temporary file first, a half written map is never loaded
+                with open(path + '.tmp', 'wb') as f:
+                    np.save(f, cost)
+                os.replace(path + '.tmp', path)
+                self._account(os.path.getsize(path))
+            except OSError as e:
+                print('WARN: Gradient Tile Not Cached: ', e)
+
+    def _remember(self, key, cost):
+        self.maps[key] = cost
+        self.maps.move_to_end(key)
+        while len(self.maps) > self.size:
+            self.maps.popitem(last=False)
+
 
 class Livewire(object):
 
@@ -24,13 +233,25 @@ class Livewire(object):
         '''
         self.image = image
         self.scale = scale
-        self.status = [None, None] # the current image_checksum and scale
+        self.status = [None, None, None] # the current image_checksum, scale and frame
         self.scale_x, self.scale_y = None, None
         self.size_x, self.size_y = None, None
+        self.gray = None
+        self.g_max = None
         self.cost = None
-        self.cost_G = None
         self.seed = None
         self.previous = None
+        self.roi = None # (x0, y0, width) of previous and cost
+        self.settled_radius = 0
+        self.lazy = False
+        # seed expansion runs in a background worker,
+        # generation is increased by every new seed to cancel stale work
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.demand = 0
+        self.worker = None
+        self.on_update = None
+        self.cache = CostMapCache()
 
         self.set_image(image)
     
@@ -53,33 +274,62 @@ class Livewire(object):
             self.scale = scale
         if self.image is not None and self.image.is_open() and self.scale is not None:
             check_sum = self.image.checksum()
-            if check_sum != self.status[0] or self.scale != self.status[1]:
-                self.status[0], self.status[1] = check_sum, self.scale
-                self.size_x, self.size_y = int(self.image.width*self.scale), int(self.image.height*self.scale)
-                image = cv2.resize(self.image.get_gray(), (self.size_x, self.size_y))
-                image = cv2.GaussianBlur(image, (11,11), 1)
-                self.scale_x, self.scale_y = image.shape[1]/self.image.width, image.shape[0]/self.image.height
-                self.cost_G = gradient_cost(image) 
+            key = (check_sum, self.scale, self.image.idx)
+            if key != tuple(self.status):
+                self.cancel()
+                size_x, size_y = int(self.image.width*self.scale), int(self.image.height*self.scale)
+                # gradients are computed per tile around the seeds, only the resized image is kept
+                gray = cv2.resize(self.image.get_gray(), (size_x, size_y))
+                # None until the worker has computed it
+                g_max = self.cache.get_max(key)
+                with self.cond:
+                    self.status = list(key)
+                    self.size_x, self.size_y = size_x, size_y
+                    self.scale_x, self.scale_y = size_x/self.image.width, size_y/self.image.height
+                    self.gray, self.g_max = gray, g_max
     
+    def _gradient_tile(self, gray, status, row, col):
+        key = tuple(status) + (row, col)
+        G = self.cache.get(key)
+        if G is None:
+            T, M = COST_TILE_SIZE, COST_TILE_MARGIN
+            H, W = gray.shape
+            x0, y0 = col*T, row*T
+            x1, y1 = min(x0+T, W), min(y0+T, H)
+            mx0, my0 = max(0, x0-M), max(0, y0-M)
+            mx1, my1 = min(W, x1+M), min(H, y1+M)
+            G = gradient_map(gray[my0:my1, mx0:mx1])
+            G = G[y0-my0:y1-my0, x0-mx0:x1-mx0].astype(np.float32)
+            self.cache.put(key, G)
+        return G
+
+    def cost_map(self, gray, status, g_max, x0, y0, x1, y1):
+        '''
+        cost of the region [x0, x1) x [y0, y1), assembled from gradient tiles,
+        gradients are normalized by the maximum of the whole image
+        Args:
+            gray: resized gray image of the computational scale
+            status: (checksum, scale, frame) of gray
+            g_max: gradient maximum of the whole gray image
+        '''
+        T = COST_TILE_SIZE
+        G = np.zeros((y1-y0, x1-x0), np.float32)
+        for row in range(y0//T, (y1-1)//T+1):
+            for col in range(x0//T, (x1-1)//T+1):
+                tile = self._gradient_tile(gray, status, row, col)
+                tx0, ty0 = col*T, row*T
+                ix0, iy0 = max(x0, tx0), max(y0, ty0)
+                ix1, iy1 = min(x1, tx0+tile.shape[1]), min(y1, ty0+tile.shape[0])
+                G[iy0-y0:iy1-y0, ix0-x0:ix1-x0] = tile[iy0-ty0:iy1-ty0, ix0-tx0:ix1-tx0]
+        if g_max <= 0:
+            return np.ones_like(G)
+        return 1-G/g_max
+
     def is_valid(self):
         if self.status[0] is None or self.status[1] is None:
             return False
         return True
 
-    def _pt2index(self, pt):
-        return pt[0] + pt[1] * self.size_x
-    
-    def _index2pt(self, ind):
-        return (ind % self.size_x, ind // self.size_x)
-
-    def _get_neighbors(self, pt):
-        xx = list(range(max(0, pt[0]-1), min(pt[0]+2, self.size_x)))
-        yy = list(range(max(0, pt[1]-1), min(pt[1]+2, self.size_y)))
-        for x in xx:
-            for y in yy:
-                if x != pt[0] or y != pt[1]:
-                    yield (x, y)
-    
     def _pt_in_img(self, pt):
         '''
         Args:
@@ -91,62 +341,161 @@ class Livewire(object):
 
     def set_seed(self, x, y, live_radius=100):
         '''
+        the seed is expanded in the background, partial results are published 
+        as the settled disk grows and on_update is called from the worker thread
         Args:
             x: x coordinate (horizontal direction)
             y: y coordinate (vertical direction)
-            live_radius: int
+            live_radius: int, or None for lazy expansion driven by get_path
         '''
         if not self.is_valid():
             self.sync_image()
         if self.is_valid():
-            start = time.time()
-
             seed = (round(x*self.scale_x), round(y*self.scale_y))
-            self.seed = seed
-
-            if self._pt_in_img(self.seed):
-                processed = np.ones((self.size_y, self.size_x), dtype=np.bool)
-                rr, cc = disk(seed[1], seed[0], live_radius, shape=(self.size_y, self.size_x))
-                processed[rr, cc] = False
-
-                self.previous = np.zeros((self.size_y, self.size_x), np.int32)-1
-                self.cost = np.ones((self.size_y, self.size_x)) + float('inf')
-
-                active = [(0, tuple(seed))]
-                while len(active) > 0:
-                    C, k = heapq.heappop(active)
-                    ind_k = self._pt2index(k)
-
-                    if processed[k[1], k[0]]:
-                        continue
+            with self.cond:
+                self.generation += 1
+                self.seed = seed
+                self.lazy = live_radius is None
+                self.previous, self.cost, self.roi = None, None, None
+                self.settled_radius = 0
+                self.demand = 0 if self.lazy else live_radius
+                self.seed_time = time.time()
+                self.cond.notify_all()
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
 
-                    processed[k[1], k[0]] = True
-                    for n in self._get_neighbors(k):
+    def cancel(self):
+        with self.cond:
+            self.generation += 1
+            self.seed = None
+            self.previous, self.cost, self.roi = None, None, None
+            self.settled_radius = 0
+            self.demand = 0
+            self.cond.notify_all()
 
-                        if processed[n[1], n[0]]:
-                            continue
+    def _run(self):
+        '''
+        worker loop: grow the settled disk of the current seed until it covers the demand,
+        the radius at least doubles per step, so the total work stays proportional to 
+        the area of the final disk
+        '''
+        while True:
+            with self.cond:
+                while self.seed is None or self.demand <= self.settled_radius or not self._pt_in_img(self.seed):
+                    self.cond.wait()
+                generation, seed, gray, status, g_max = self.generation, self.seed, self.gray, list(self.status), self.g_max
+                radius = min(max(LAZY_MIN_RADIUS, 2*self.settled_radius), self.demand)
+                # no need to grow beyond the image
+                radius = min(radius, int(math.ceil(math.hypot(self.size_x, self.size_y))))
+                radius = max(radius, self.settled_radius+1)
+            try:
+                if g_max is None:
+                    # once per image, scale and frame, costs are normalized by the maximum of the whole image
+                    g_max = gradient_max(gray)
+                    self.cache.put_max(tuple(status), g_max)
+                    with self.cond:
+                        if status == self.status:
+                            self.g_max = g_max
+                H, W = gray.shape
+                x0, x1 = max(0, seed[0]-radius), min(W, seed[0]+radius+1)
+                y0, y1 = max(0, seed[1]-radius), min(H, seed[1]+radius+1)
+                cost_roi = self.cost_map(gray, status, g_max, x0, y0, x1, y1)
+                previous, cost = shortest_path_tree(cost_roi, (seed[0]-x0, seed[1]-y0), radius)
+            except Exception as e:
+                # drop the seed, so that waiting callers are released and the worker keeps serving new seeds
+                print('WARN: Livewire Expansion Failed: ', e)
+                with self.cond:
+                    if generation == self.generation:
+                        self.generation += 1
+                        self.seed = None
+                        self.previous, self.cost, self.roi = None, None, None
+                        self.settled_radius = 0
+                        self.demand = 0
+                    self.cond.notify_all()
+                continue
+            with self.cond:
+                if generation != self.generation:
+                    continue
+                self.previous, self.cost, self.settled_radius = previous, cost, radius
+                self.roi = (x0, y0, x1-x0)
+                if radius >= self.demand:
+                    print('INFO: Seed Expanded to Radius {} in {} Seconds'.format(radius, time.time()-self.seed_time))
+                self.cond.notify_all()
+            if self.on_update is not None:
+                try:
+                    self.on_update()
+                except Exception as e:
+                    print('WARN: Livewire Update Failed: ', e)
 
-                        delta = (k[1]-n[1], k[0]-n[0])
-                        delta_A = math.sqrt(delta[0]**2+delta[1]**2)
+    def _request(self, pt, wait=False):
+        '''
+        ask the worker to settle pt, optionally block until it is settled
+        Args:
+            pt: coordinate tuple (x, y) in computational scale
+        '''
+        with self.cond:
+            if self.seed is None or not self._pt_in_img(self.seed):
+                return
+            if self.lazy:
+                dist = math.hypot(pt[0]-self.seed[0], pt[1]-self.seed[1])
+                demand = min(int(math.ceil(dist*LAZY_MARGIN))+1, int(math.ceil(math.hypot(self.size_x, self.size_y))))
+                if demand > self.demand:
+                    self.demand = demand
+                    self.cond.notify_all()
+            if wait:
+                generation = self.generation
+                target = min(self.demand, math.hypot(pt[0]-self.seed[0], pt[1]-self.seed[1])+1)
+                while generation == self.generation and self.settled_radius < target:
+                    self.cond.wait()
 
-                        C_tmp = C + self.cost_G[n[1], n[0]]*delta_A
-                        if C_tmp < self.cost[n[1], n[0]]:
-                            self.cost[n[1], n[0]] = C_tmp
-                            self.previous[n[1], n[0]] = self._pt2index(k)
-                        heapq.heappush(active, (C_tmp, n))
-                print('INFO: New Seed Computed in {} Seconds'.format(time.time()-start))
+    def is_settled(self, x, y):
+        '''
+        whether the path from (x, y) is final, without blocking: the point is settled,
+        or it can not be reached (outside the image, beyond a fixed live radius, no seed)
+        '''
+        if not self.is_valid():
+            return True
+        pt = (round(x*self.scale_x), round(y*self.scale_y))
+        if not self._pt_in_img(pt):
+            return True
+        self._request(pt)
+        with self.cond:
+            if self.seed is None or not self._pt_in_img(self.seed):
+                return True
+            return self.settled_radius >= min(self.demand, math.hypot(pt[0]-self.seed[0], pt[1]-self.seed[1])+1)
 
-    def get_path(self, x, y):
+    def get_path(self, x, y, wait=False):
+        '''
+        path from (x, y) back to the seed, if the point is not settled yet,
+        the path starts at the settled point closest to it on the line towards the seed
+        Args:
+            wait: block until the point is settled
+        '''
         pt = (round(x*self.scale_x), round(y*self.scale_y))
         path = [pt] 
-        if self.previous is not None and self._pt_in_img(pt):
-            ind_p = self.previous[pt[1], pt[0]]
-            while self.seed is not None:
-                if ind_p == -1:
-                    break
-                pt_p = self._index2pt(ind_p)
+        if self._pt_in_img(pt):
+            self._request(pt, wait)
+        with self.cond:
+            seed, previous, radius, roi = self.seed, self.previous, self.settled_radius, self.roi
+        if previous is not None and self._pt_in_img(pt):
+            x0, y0, w = roi
+            h = previous.shape[0]
+            dist = math.hypot(pt[0]-seed[0], pt[1]-seed[1])
+            settled = lambda p: x0 <= p[0] < x0+w and y0 <= p[1] < y0+h and previous[p[1]-y0, p[0]-x0] != -1
+            if pt != seed and not settled(pt):
+                # closest point on the line towards the seed inside the settled disk, the seed if the disk is tiny
+                if dist > 0 and radius > 2:
+                    t = min(1, (radius-2)/dist)
+                    pt = (round(seed[0]+(pt[0]-seed[0])*t), round(seed[1]+(pt[1]-seed[1])*t))
+                if pt != seed and not settled(pt):
+                    pt = seed
+                path.append(pt)
+            ind_p = previous[pt[1]-y0, pt[0]-x0]
+            while ind_p != -1:
+                pt_p = (ind_p % w + x0, ind_p // w + y0)
                 path.append(pt_p)
-                ind_p = self.previous[pt_p[1], pt_p[0]]
+                ind_p = previous[pt_p[1]-y0, pt_p[0]-x0]
         path = np.array(path)
         path[:,0] = path[:,0]/self.scale_x
         path[:,1] = path[:,1]/self.scale_y
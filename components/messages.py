@@ -14,7 +14,10 @@ class ProgressDiag(QDialog):
         self.setWindowFlags(Qt.Dialog | Qt.Desktop)
         self.progressBar.setValue(0)
         self.count = 0
+        # None if the number of items is not known in advance, the bar is busy until finish()
         self.total = total
+        if total is None:
+            self.progressBar.setRange(0, 0)
     
     def keyPressEvent(self, e):
         if e.key() != Qt.Key_Escape:
@@ -24,13 +27,22 @@ class ProgressDiag(QDialog):
         self.count += 1
         # self.fileList.addItem(msg)
         # self.fileList.setCurrentRow(self.fileList.count()-1)
+        if self.total is None:
+            self.status.setText(msg)
+            QCoreApplication.processEvents()
+            return
         if int(self.count*100/self.total) - self.progressBar.value() >= 1:
-            self.progressBar.setValue(self.count*100/self.total)
+            self.progressBar.setValue(int(self.count*100/self.total))
         self.status.setText(msg)
         if self.count == self.total:
             self.progressBar.setValue(100)
             self.close() 
         QCoreApplication.processEvents()
+
+    def finish(self):
+        self.progressBar.setRange(0, 100)
+        self.progressBar.setValue(100)
+        self.close()
     
 
 def open_message(title, msg):
@@ -0,0 +1,146 @@
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from collections import OrderedDict
+import math
+
+OVERLAY_TILE_SIZE = 512
+OVERLAY_CACHE_SIZE = 128
+# zoom levels are powers of 2, limited to this range
+OVERLAY_MIN_LEVEL, OVERLAY_MAX_LEVEL = -8, 3
+
+class AnnotationOverlay(QGraphicsItem):
+
+    """
+    rasterized display of dense annotations,
+    non-live annotations are hidden and painted into cached image tiles per zoom level,
+    live annotations (selected ones) stay normal graphics items on top of the overlay
+    """
+
+    def __init__(self, annotationMgr, tile_size=OVERLAY_TILE_SIZE, cache_size=OVERLAY_CACHE_SIZE, parent=None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.annotationMgr = annotationMgr
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.active = False
+        self.width, self.height = 0, 0
+        self.live = set()
+        self.tiles = OrderedDict()
+        self.option = QStyleOptionGraphicsItem()
+
+    def is_active(self):
+        return self.active
+
+    def set_active(self, active, width=0, height=0):
+        '''
+        Args:
+            active: rasterize annotations or show them as graphics items
+            width, height: area covered by the overlay
+        '''
+        self.prepareGeometryChange()
+        self.active = active
+        self.width, self.height = (width, height) if active else (0, 0)
+        for timestamp, anno in self.annotationMgr.items():
+            anno.graphObject.setVisible(not active or timestamp in self.live)
+        self.invalidate()
+
+    def clear(self):
+        self.live.clear()
+        self.invalidate()
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    #### changes of annotations
+
+    def add(self, anno):
+        if self.active:
+            anno.graphObject.setVisible(anno.timestamp in self.live)
+            self.invalidate(anno)
+
+    def remove(self, anno):
+        self.live.discard(anno.timestamp)
+        if self.active:
+            self.invalidate(anno)
+
+    def set_live(self, anno, live):
+        '''
+        a live annotation is drawn by its own graphics item
+        '''
+        if live:
+            self.live.add(anno.timestamp)
+        else:
+            self.live.discard(anno.timestamp)
+        if self.active:
+            anno.graphObject.setVisible(live)
+            self.invalidate(anno)
+
+    def invalidate(self, anno=None):
+        '''
+        drop the cached tiles covering the annotation, all tiles if anno is None
+        '''
+        if anno is None:
+            self.tiles.clear()
+            self.update()
+            return
+        box = self.annotationMgr.spatial.boxes.get(anno.timestamp)
+        if box is None:
+            return
+        # margin for antialiasing
+        x0, y0, x1, y1 = box[0]-1, box[1]-1, box[2]+1, box[3]+1
+        for level in set(k[0] for k in self.tiles.keys()):
+            span = self.tile_size / 2**level
+            for row in range(int(math.floor(y0/span)), int(math.floor(y1/span))+1):
+                for col in range(int(math.floor(x0/span)), int(math.floor(x1/span))+1):
+                    self.tiles.pop((level, row, col), None)
+        self.update(QRectF(x0, y0, x1-x0, y1-y0))
+
+    #### rendering
+
+    def _level(self, lod):
+        # the raster resolution is at least the screen resolution
+        level = int(math.ceil(math.log2(lod))) if lod > 0 else 0
+        return min(max(level, OVERLAY_MIN_LEVEL), OVERLAY_MAX_LEVEL)
+
+    def _tile(self, level, row, col):
+        key = (level, row, col)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        T, s = self.tile_size, 2**level
+        span = T / s
+        rect = QRectF(col*span, row*span, span, span)
+        image = QImage(T, T, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.scale(s, s)
+        painter.translate(-rect.left(), -rect.top())
+        base = painter.transform()
+        # bottom first, the index returns the topmost annotation first
+        for anno in reversed(self.annotationMgr.annotations_in_rect(rect)):
+            if anno.timestamp in self.live:
+                continue
+            item = anno.graphObject
+            painter.setTransform(item.sceneTransform() * base)
+            item.paint(painter, self.option, None)
+        painter.end()
+        self.tiles[key] = image
+        while len(self.tiles) > self.cache_size:
+            self.tiles.popitem(last=False)
+        return image
+
+    def paint(self, painter, option, widget=None):
+        if not self.active:
+            return
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self._level(lod)
+        span = self.tile_size / 2**level
+        rect = option.exposedRect.intersected(self.boundingRect())
+        if rect.isEmpty():
+            return
+        for row in range(int(rect.top()//span), int(math.ceil(rect.bottom()/span))):
+            for col in range(int(rect.left()//span), int(math.ceil(rect.right()/span))):
+                image = self._tile(level, row, col)
+                painter.drawImage(QRectF(col*span, row*span, span, span), image, QRectF(image.rect()))
@@ -1,37 +1,55 @@
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QFileDialog
-from .image import compute_checksum, Image
+from .image import compute_checksum, image_meta, Image, CHECKSUM_CACHE
 from .func_annotation import *
 from .messages import annotation_move_message, ProgressDiag
 from .enumDef import *
+from .projectStore import ProjectStore
+from .fileMatch import match_files, find_duplicates, file_size
+from .fileWalk import walk_files, DEFAULT_EXCLUDE
+from .annoSummary import SUMMARY_CACHE, summary_report
 # from .contour import *
 import uuid
+import itertools
 from datetime import datetime as datim
 import copy
 
 from time import sleep
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import shutil
 import json
 import os
 import csv
 
-PROJ = {'project_name': '', 'folders': [], 'images': []}
+# legacy json project file, still supported for import and export
+PROJ_EXT = '.improj'
+# sqlite project index
+PROJ_DB_EXT = '.imdb'
+PROJ = {'project_name': '', 'folders': [], 'images': [], 'annotation_format': 'json'}
+# annotation file extension of each annotation format
+ANNOTATION_FORMATS = {'json': ANNOTATION_EXT, 'binary': BINARY_ANNOTATION_EXT}
+# images imported per batch, the project index is committed after each batch
+IMPORT_BATCH_SIZE = 512
+# threads hashing images and copying annotation files during import
+IMPORT_WORKERS = 8
 ITEM = {'idx': None, 'name': None, 'ext': None, 'checksum': None, 'image_path': None, 'rel_path': False, 'annotation_path': None, 'status': UNFINISHED, 'folder': None}
 
 class Item(object):
 
-    def __init__(self, proj_dir=None):    
+    def __init__(self, proj_dir=None, anno_ext=ANNOTATION_EXT):    
         self.data = ITEM.copy()
+        self.anno_ext = anno_ext
+        # called with the item after data changed, set by the project to track changes
+        self.on_change = None
         if isinstance(proj_dir, str):
             self.proj_dir = proj_dir.replace('\\', '/') 
         else:
             self.proj_dir = proj_dir
     
     @classmethod
-    def create(cls, data_dict, proj_dir):
-        obj = cls(proj_dir)
+    def create(cls, data_dict, proj_dir, anno_ext=ANNOTATION_EXT):
+        obj = cls(proj_dir, anno_ext)
         obj.data = data_dict
         obj.data['image_path'] = obj.data['image_path'].replace('\\', '/') 
         # obj.data['annotation_path'] = obj.data['annotation_path'].replace('\\', '/') 
@@ -40,12 +58,14 @@ class Item(object):
     def idx(self):
         return self.data['idx']
 
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
     def set_idx(self, idx):
         self.data['idx'] = idx
-        # self.set_annotation_path()
-        anno_dir = os.path.join(self.proj_dir, 'annotations', idx)
-        if not os.path.exists(anno_dir):
-            os.makedirs(anno_dir)
+        self._changed()
+        # the annotation directory is created when the first annotation file is written
     
     def exists(self):
         path = self.image_path()
@@ -62,17 +82,21 @@ class Item(object):
     
     ## set and get image path
 
-    def set_image_path(self, path, rel_path=True):
+    def set_image_path(self, path, rel_path=True, checksum=True):
+        '''
+        Args:
+            checksum: compute the checksum, otherwise it is set by the caller
+        '''
         path = os.path.abspath(os.path.realpath(path))
         path = path.replace('\\', '/') 
-        print(path, self.proj_dir)
         if rel_path and path.startswith(self.proj_dir):
-            print('True')
             self.data['rel_path'] = True
             path = os.path.relpath(path, start=self.proj_dir)
         self.data['image_path'] = path
         self.data['name'], self.data['ext'] = os.path.splitext(os.path.basename(path))
-        self.set_checksum()
+        if checksum:
+            self.set_checksum()
+        self._changed()
 
     def image_path(self):
         if self.data['image_path'] is not None:
@@ -101,7 +125,7 @@ class Item(object):
     def annotation_path(self):
         if self.data['idx'] is not None:
             # return os.path.join(self.proj_dir, self.data['annotation_path'])
-            return os.path.join(self.proj_dir, 'annotations', self.data['idx'], 'anno'+ANNOTATION_EXT)
+            return os.path.join(self.proj_dir, 'annotations', self.data['idx'], 'anno'+self.anno_ext)
         else:
             return None
 
@@ -117,14 +141,39 @@ class Item(object):
     def set_checksum(self):
         if self.exists():
             self.data['checksum'] = compute_checksum(self.image_path())
+            self.data['size'] = file_size(self.image_path())
+            self._changed()
 
     def checksum(self):
         if self.data['checksum'] is None:
             path = self.image_path()
             if path is not None:
                 self.data['checksum'] = compute_checksum(path)
+                self._changed()
         return self.data['checksum']
 
+    def size(self):
+        '''
+        file size, recorded with the checksum
+        '''
+        return self.data.get('size')
+
+    ## image metadata setter and getter
+
+    def set_meta(self, meta):
+        self.data['meta'] = meta
+        self._changed()
+
+    def meta(self, read=True):
+        '''
+        width, height, channels, frames and dtype of the image, read from the header once
+        Args:
+            read: read the header if the meta is not stored, otherwise None is returned
+        '''
+        if read and self.data.get('meta') is None and self.exists():
+            self.set_meta(image_meta(self.image_path()))
+        return self.data.get('meta')
+
     ## status setter and getter
 
     def set_status(self, status):
@@ -134,6 +183,7 @@ class Item(object):
                 # with h5py.File(anno_path, 'a') as location:
                 #     location.attrs['status'] = status
                 self.data['status'] = status
+                self._changed()
 
     def status(self):
         return self.data['status']
@@ -142,10 +192,30 @@ class Item(object):
 
     def set_folder(self, folder):
         self.data['folder'] = folder
+        self._changed()
     
     def folder(self):
         return self.data['folder']
 
+def _import_image(image_path, anno_path):
+    '''
+    the file work of adding an image, runs on worker threads and does not touch the project
+    Return: checksum, size and metadata of the image, status of the copied annotation file or None
+    '''
+    checksum, size, meta = compute_checksum(image_path), file_size(image_path), image_meta(image_path)
+    # copy annotation file if exist 
+    ## hdf5 compatible
+    status = None
+    annotation_json = os.path.splitext(image_path)[0] + ANNOTATION_EXT
+    annotation_hdf5 = os.path.splitext(image_path)[0] + '.hdf5'
+    if os.path.isfile(annotation_json):
+        status = get_status(annotation_json)
+        anno_copy(anno_path, annotation_json)
+    elif os.path.isfile(annotation_hdf5):
+        status = get_status(annotation_hdf5)
+        anno_copy(anno_path, annotation_hdf5)
+    return checksum, size, meta, status
+
 class Project(object):
     def __init__(self, annotationMgr=None):
         self.annotationMgr = annotationMgr
@@ -153,10 +223,14 @@ class Project(object):
         self.project_dir = None
         self.proj_file = None
         self.annotation_dir = None
+        self.store = None
         self.data = {}
         self.index_id = {}
         self.index_folder = {}
         # self.index_checksum = {}
+        # changes not yet written to the store
+        self.dirty = set()
+        self.removed = set()
         self.project_open = False
 
     def is_open(self):
@@ -164,59 +238,131 @@ class Project(object):
     
     def open(self, path):
         '''
-        path to the project directory / project file
+        path to the project directory / project file (.imdb, or a legacy .improj which is imported)
         '''
-        if os.path.splitext(path)[1] == '.improj':
+        if self.store is not None:
+            self.store.close()
+        self.dirty.clear()
+        self.removed.clear()
+        if os.path.splitext(path)[1] in [PROJ_EXT, PROJ_DB_EXT]:
             self.proj_dir = os.path.abspath(os.path.realpath(os.path.dirname(path))) 
-            self.proj_file = path
+            base = os.path.splitext(path)[0]
         else:
             self.proj_dir = os.path.abspath(os.path.realpath(path))
-            f = glob.glob(os.path.join(path, '*.improj'))
+            f = glob.glob(os.path.join(path, '*'+PROJ_DB_EXT)) + glob.glob(os.path.join(path, '*'+PROJ_EXT))
             if len(f) > 0:
-                self.proj_file = f[0]
+                base = os.path.splitext(f[0])[0]
             else:
-                self.proj_file = os.path.join(path, os.path.basename(path)+'.improj')
+                base = os.path.join(path, os.path.basename(path))
+        self.proj_file = base + PROJ_DB_EXT
+        legacy_file = base + PROJ_EXT
         # create directories when necessary
         if not os.path.exists(self.proj_dir):
             os.makedirs(self.proj_dir)
         self.annotation_dir = os.path.join(self.proj_dir, 'annotations')
         if not os.path.exists(self.annotation_dir):
             os.makedirs(self.annotation_dir)
-        # load project file if exists
-        if not os.path.exists(self.proj_file):
-            self.data = PROJ.copy()
-            self.data['project_name'] = os.path.basename(self.proj_file)[:-7]
+        # load project index, a legacy project file is imported once
+        new_store = not os.path.exists(self.proj_file)
+        self.store = ProjectStore(self.proj_file)
+        CHECKSUM_CACHE.update(self.store.load_checksums())
+        SUMMARY_CACHE.update(self.store.load_summaries())
+        if new_store and os.path.exists(legacy_file):
+            self.import_improj(legacy_file)
         else:
-            with open(self.proj_file) as json_file:
-                self.data = json.load(json_file)
-            self.index_id = {e['idx']: Item.create(e, self.proj_dir) for e in self.data['images']}
+            self.data = PROJ.copy()
+            self.data['project_name'] = os.path.basename(base)
+            self.data.update(self.store.load_meta())
+            self.data['folders'] = self.store.load_folders()
+            self.data['images'] = []
+            self.index_id = {e['idx']: Item.create(e, self.proj_dir, self.annotation_ext()) for e in self.store.load_items()}
             self.index_folder = self.get_index('folder')
+            for item in self.index_id.values():
+                item.on_change = self._item_changed
+            for folder in self.data['folders']:
+                self.add_folder(folder)
         self.project_name = self.data['project_name']
         # compute current idx
         self.project_open = True
+        if new_store:
+            self.save()
+
+    def import_improj(self, path):
+        '''
+        read a legacy .improj file into the project index
+        '''
+        with open(path) as json_file:
+            self.data = json.load(json_file)
+        self.index_id = {e['idx']: Item.create(e, self.proj_dir, self.annotation_ext()) for e in self.data['images']}
+        self.index_folder = self.get_index('folder')
+        for folder in self.data['folders']:
+            self.add_folder(folder)
+        for item in self.index_id.values():
+            item.on_change = self._item_changed
+        self.data['images'] = []
+        self.dirty = set(self.index_id.keys())
+        print('INFO: {} Images Imported from {}'.format(len(self.index_id), path))
+
+    def export_improj(self, path=None):
+        '''
+        write the project index as a legacy .improj file
+        '''
+        if not self.is_open():
+            return
+        if path is None:
+            path = QFileDialog.getSaveFileName(caption='Export Project File', directory=self.proj_dir, filter="Project(*"+PROJ_EXT+")")[0]
+            if len(path) == 0:
+                return
+        data = {k: v for k, v in self.data.items()}
+        data['folders'] = list(self.index_folder.keys())
+        data['images'] = [item.data for item in self.index_id.values()]
+        with open(path, 'w') as outfile:
+            json.dump(data, outfile, indent=4)
+
+    def _item_changed(self, item):
+        if item.idx() is not None:
+            self.dirty.add(item.idx())
+
+    def _track(self, item):
+        item.on_change = self._item_changed
+        self._item_changed(item)
 
     def close(self):
         if self.project_open:
             if self.annotationMgr is not None:
                 self.annotationMgr.save()
+                self.annotationMgr.flush()
             self.save()
+            self.store.close()
         self.project_name = None
         self.proj_dir = None
         self.proj_file = None
         self.annotation_dir = None
+        self.store = None
         self.data = {}
         self.index_id = {}
         self.index_folder = {}
+        self.dirty.clear()
+        self.removed.clear()
         self.project_open = False
     
     def save(self):
+        '''
+        write changed items, folders and settings to the project index
+        '''
         if self.is_open():
             self.data['folders'] = list(self.index_folder.keys())
-            self.data['images'] = []
-            for item in self.index_id.values():
-                self.data['images'].append(item.data)
-            with open(self.proj_file, 'w') as outfile:
-                json.dump(self.data, outfile, indent=4)
+            self.store.put_items([self.index_id[idx].data for idx in self.dirty if idx in self.index_id.keys()])
+            self.store.delete_items([idx for idx in self.removed if idx not in self.index_id.keys()])
+            self.store.set_folders(self.data['folders'])
+            self.store.put_checksums(CHECKSUM_CACHE.take_changed())
+            self.store.put_summaries(SUMMARY_CACHE.take_changed())
+            for key in ['project_name', 'annotation_format']:
+                if key in self.data.keys():
+                    self.store.set_meta(key, self.data[key])
+            self.store.commit()
+            self.dirty.clear()
+            self.removed.clear()
 
     ## folder operations
     def add_folder(self, folder_name):
@@ -228,12 +374,15 @@ class Project(object):
             # do not call self.remove_image for faster speed
             for item in self.index_folder[folder_name]:
                 if remove_image:
-                    if self.annotationMgr is not None and item.annotation_path() == self.annotationMgr.annotation_path:
-                        self.annotationMgr.close()
+                    if self.annotationMgr is not None:
+                        if item.annotation_path() == self.annotationMgr.annotation_path:
+                            self.annotationMgr.close()
+                        self.annotationMgr.saver.flush(item.annotation_path())
                     anno_dir = item.annotation_dir()
                     if os.path.exists(anno_dir):
                         shutil.rmtree(anno_dir)
                     del self.index_id[item.idx()]
+                    self.removed.add(item.idx())
                 else:
                     item.set_folder(None)
             del self.index_folder[folder_name]
@@ -247,54 +396,74 @@ class Project(object):
     ## image operations
 
     def add_images(self, images, folders=None):
+        '''
+        images are hashed and their annotation files copied on a thread pool,
+        the project index is committed once per batch
+        Args:
+            images: list of image paths, or an iterable (e.g. walk_files) consumed batch by batch as it is produced
+            folders: one folder for all images or a list of folders
+        '''
         idxs = []
         if folders is None or isinstance(folders, str):
-            folders = [folders] * len(images)
-        if len(images) > 0:
-            progress = ProgressDiag(len(images), 'Adding images to project...')
-            progress.show()
-        for img, folder in zip(images, folders):
-            idx = self.add_image(img, folder)
-            progress.new_item('Added: ' + img)
-            # QCoreApplication.processEvents()
-            if idx is not None:
-                idxs.append(idx)
+            folders = itertools.repeat(folders)
+        total = len(images) if hasattr(images, '__len__') else None
+        if total == 0:
+            return idxs
+        pairs = zip(images, folders)
+        progress = ProgressDiag(total, 'Adding images to project...')
+        progress.show()
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+            while True:
+                batch = list(itertools.islice(pairs, IMPORT_BATCH_SIZE))
+                if len(batch) == 0:
+                    break
+                items = [self._new_item() for _ in batch]
+                jobs = pool.map(_import_image, [img for img, _ in batch], [item.annotation_path() for item in items])
+                for (img, folder), item, (checksum, size, meta, status) in zip(batch, items, jobs):
+                    self._insert_item(item, img, folder, checksum, size, meta, status)
+                    idxs.append(item.idx())
+                    progress.new_item('Added: ' + img)
+                self.save()
+        progress.finish()
         return idxs
     
     def add_image(self, image_path, folder=None):
-        item = Item(self.proj_dir)
-        idx = uuid.uuid4().hex
-        # set idx (annotation is also set here) 
-        item.set_idx(idx) 
-        # add image path (checksum is also set here)  
-        item.set_image_path(image_path)
-        # copy annotation file if exist 
-        ## hdf5 compatible
-        annotation_json = os.path.splitext(image_path)[0] + ANNOTATION_EXT
-        annotation_hdf5 = os.path.splitext(image_path)[0] + '.hdf5'
-        if os.path.isfile(annotation_json):
-            item.set_status(get_status(annotation_json))
-            anno_copy(item.annotation_path(), annotation_json)
-        elif os.path.isfile(annotation_hdf5):
-            item.set_status(get_status(annotation_json))
-            anno_copy(item.annotation_path(), annotation_hdf5)
+        item = self._new_item()
+        checksum, size, meta, status = _import_image(image_path, item.annotation_path())
+        self._insert_item(item, image_path, folder, checksum, size, meta, status)
+        return item.idx()
+
+    def _new_item(self):
+        item = Item(self.proj_dir, self.annotation_ext())
+        item.set_idx(uuid.uuid4().hex)
+        return item
+
+    def _insert_item(self, item, image_path, folder, checksum, size, meta, status):
+        # add image path, the checksum is computed by _import_image
+        item.set_image_path(image_path, checksum=False)
+        item.data['checksum'], item.data['size'], item.data['meta'] = checksum, size, meta
+        if status is not None:
+            item.set_status(status)
         # update index
-        self.index_id[idx] = item
+        self.index_id[item.idx()] = item
+        self._track(item)
         self.add_folder(folder)
         if folder in self.index_folder.keys():
             item.set_folder(folder)
             self.index_folder[folder].append(item)
-        return idx
 
     def remove_image(self, idx):
         if idx in self.index_id.keys():
             item = self.index_id[idx]
-            if self.annotationMgr is not None and item.annotation_path == self.annotationMgr.annotation_path:
-                self.annotationMgr.close()
+            if self.annotationMgr is not None:
+                if item.annotation_path == self.annotationMgr.annotation_path:
+                    self.annotationMgr.close()
+                self.annotationMgr.saver.flush(item.annotation_path())
             anno_dir = item.annotation_dir()
             if os.path.exists(anno_dir):
                 shutil.rmtree(anno_dir)
             del self.index_id[idx]
+            self.removed.add(idx)
             folder = item.folder()
             if folder in self.index_folder.keys():
                 for i in range(len(self.index_folder[folder])):
@@ -314,14 +483,54 @@ class Project(object):
         else:
             return None
     
+    def get_image_meta(self, idx, read=True):
+        if idx in self.index_id.keys():
+            return self.index_id[idx].meta(read)
+        else:
+            return None
+
     def get_image_name(self, idx):
         if idx in self.index_id.keys():
             return self.index_id[idx].image_name()
         else:
             return None
 
+    ## cache directory
+
+    def cache_dir(self):
+        if self.is_open():
+            return os.path.join(self.proj_dir, 'cache')
+        else:
+            return None
+
     ## annotation path setter and getter
 
+    ## annotation format
+
+    def annotation_format(self):
+        return self.data.get('annotation_format', 'json')
+
+    def annotation_ext(self):
+        return ANNOTATION_FORMATS[self.annotation_format()]
+
+    def set_annotation_format(self, fmt):
+        '''
+        existing annotation files are converted to the new format,
+        the annotation manager should not hold a file of this project
+        Args:
+            fmt: 'json' or 'binary'
+        '''
+        if self.is_open() and fmt in ANNOTATION_FORMATS.keys() and fmt != self.annotation_format():
+            ext = ANNOTATION_FORMATS[fmt]
+            progress = ProgressDiag(len(self.index_id), 'Converting annotations ...')
+            progress.show()
+            for item in self.index_id.values():
+                progress.new_item('Converted: ' + item.image_path())
+                anno_convert(item.annotation_path(), ext)
+                item.anno_ext = ext
+            self.data['annotation_format'] = fmt
+            self.save()
+
     def get_annotation_path(self, idx):
         if idx in self.index_id.keys():
             return self.index_id[idx].annotation_path()
@@ -356,21 +565,6 @@ class Project(object):
 
     ## compute index
 
-    def get_files(self, folder, progressBar=False):
-        files = []
-        fnames = [str(path) for t in IMAGE_TYPES for path in Path(folder).rglob(t)]
-        if progressBar:
-            progress = ProgressDiag(len(fnames), 'Retrieving images...')
-            progress.show()
-        for f in fnames:
-            if progressBar:
-                progress.new_item('retrieved image: ' + f)
-                # QCoreApplication.processEvents()
-            item = Item(self.proj_dir)
-            item.set_image_path(f)
-            files.append(item)
-        return files
-
     def get_index(self, attr_name, files=None, check_exist=False, progressBar=False):
         '''
         if the attr_name is not available, item will not be indexed
@@ -416,68 +610,83 @@ class Project(object):
     ## dataset report
 
     def report(self):
+        '''
+        counts from the annotation summary cache, only changed files are read
+        '''
+        total, stats = 0, {}
         if self.is_open():
-            progress = ProgressDiag(len(self.index_id), 'Counting...')
-            progress.show()
-
-            total, stats = 0, {}
-            for _, item in self.index_id.items():
-                t, s = anno_report(item.annotation_path())
-                progress.new_item('Counted: ' + item.image_path())
-                total += t
-                for k, v in s.items():
-                    if k not in stats.keys():
-                        stats[k] = {}
-                    for kk, vv in v.items():
-                        if kk not in stats[k].keys():
-                            stats[k][kk] = vv
-                        else:
-                            stats[k][kk] += vv
+            total, stats = summary_report([item.annotation_path() for item in self.index_id.values()])
         return total, stats        
 
     
     ## search missing images
 
-    def search_image(self, folder):
+    def _map_progress(self, msg, progress=None):
+        '''
+        Args:
+            progress: a ProgressDiag kept open across calls, otherwise a dialog is shown per call
+        Return: a mapper for fileMatch, running on a thread pool and showing the progress
+        '''
+        def mapper(func, paths):
+            if len(paths) == 0:
+                return []
+            dialog = progress
+            if dialog is None:
+                dialog = ProgressDiag(len(paths), msg)
+                dialog.show()
+            results = []
+            with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+                for path, r in zip(paths, pool.map(func, paths)):
+                    dialog.new_item('processed: ' + path)
+                    results.append(r)
+            return results
+        return mapper
+
+    def search_image(self, folder, exclude=DEFAULT_EXCLUDE, max_depth=None):
+        '''
+        missing images are matched by size, then checksum, then the hash of the whole file,
+        each stage only looks at the files that are still candidates,
+        sizes are read batch by batch while the folder is walked
+        '''
         if os.path.exists(folder):
-            files = self.get_files(folder, progressBar=True)
-            index_checksum = self.get_index('checksum', files, progressBar=True)
-
-            progress = ProgressDiag(len(self.index_id), 'Seaching missing images...')
-            progress.show()
-
-            for _, item in self.index_id.items():
-                progress.new_item('processed: ' + item.image_path())
-                # QCoreApplication.processEvents()
-                if item.exists():
-                    continue
-                checksum = item.checksum()
-                if checksum is not None and checksum in index_checksum.keys():
-                    item.set_image_path(index_checksum[checksum][0].image_path())
+            wanted = {}
+            for idx, item in self.index_id.items():
+                if not item.exists() and item.checksum() is not None:
+                    wanted[idx] = (item.size(), item.checksum())
+            if len(wanted) == 0:
+                return
+            scanning = ProgressDiag(None, 'Scanning folder...')
+            scanning.show()
+            search = self._map_progress('Seaching missing images...')
+            def mapper(func, paths):
+                # the folder is walked, the later stages show their own progress
+                scanning.finish()
+                return search(func, paths)
+            files = walk_files(folder, exclude=exclude, max_depth=max_depth)
+            matches = match_files(wanted, files, mapper=mapper, size_mapper=self._map_progress('Scanning folder...', scanning))
+            scanning.finish()
+            for idx, path in matches.items():
+                self.index_id[idx].set_image_path(path)
+            print('INFO: {} of {} Missing Images Found'.format(len(matches), len(wanted)))
     
     ## check duplicates
 
     def remove_duplicate(self):
-        index_checksum = self.get_index('checksum')
-
-        progress = ProgressDiag(len(index_checksum), 'Finding duplicates...')
-        progress.show()
-
-        for checksum, items in index_checksum.items():
-            msg = 'processed: ' + checksum + ', '.join([s.image_name() for s in items])
-            progress.new_item(msg)
-            # QCoreApplication.processEvents()
-            if len(items) > 1:
-                index_remain = 0
-                for idx, item in enumerate(items):
-                    if item.is_rel_path():
-                        index_remain = idx
-                        break
-                for idx, item in enumerate(items):
-                    if idx == index_remain:
-                        continue
-                    anno_merge(items[index_remain].annotation_path(), item.annotation_path())
-                    self.remove_image(item.idx())
+        files = [(idx, item.image_path() if item.exists() else None, item.size(), item.checksum()) for idx, item in self.index_id.items()]
+        groups = find_duplicates(files, mapper=self._map_progress('Finding duplicates...'))
+
+        for group in groups:
+            items = [self.index_id[idx] for idx in group]
+            index_remain = 0
+            for idx, item in enumerate(items):
+                if item.is_rel_path():
+                    index_remain = idx
+                    break
+            for idx, item in enumerate(items):
+                if idx == index_remain:
+                    continue
+                anno_merge(items[index_remain].annotation_path(), item.annotation_path())
+                self.remove_image(item.idx())
 
     ## export image list
 
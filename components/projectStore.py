@@ -0,0 +1,127 @@
+import sqlite3
+import json
+
+# item fields with their own (indexed) columns, other fields are kept in the json column 'extra'
+ITEM_COLUMNS = ['idx', 'name', 'ext', 'checksum', 'image_path', 'rel_path', 'status', 'folder']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    idx TEXT PRIMARY KEY,
+    name TEXT,
+    ext TEXT,
+    checksum TEXT,
+    image_path TEXT,
+    rel_path INTEGER,
+    status TEXT,
+    folder TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS folders (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS summaries (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, summary TEXT);
+CREATE TABLE IF NOT EXISTS checksums (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, checksum TEXT);
+CREATE INDEX IF NOT EXISTS items_checksum ON items (checksum);
+CREATE INDEX IF NOT EXISTS items_folder ON items (folder);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+'''
+
+class ProjectStore(object):
+
+    """
+    SQLite file holding the project index: items, folders and project settings (meta),
+    changes are written row by row, nothing is rewritten as a whole
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def commit(self):
+        self.conn.commit()
+
+    #### items
+
+    def _row(self, data):
+        row = [data.get(k) for k in ITEM_COLUMNS]
+        row[ITEM_COLUMNS.index('rel_path')] = 1 if data.get('rel_path') else 0
+        extra = {k: v for k, v in data.items() if k not in ITEM_COLUMNS}
+        row.append(json.dumps(extra) if len(extra) > 0 else None)
+        return row
+
+    def put_items(self, items_data):
+        '''
+        Args:
+            items_data: iterable of Item.data dicts, inserted or replaced
+        '''
+        self.conn.executemany('INSERT OR REPLACE INTO items VALUES ({})'.format(','.join(['?'] * (len(ITEM_COLUMNS)+1))),
+                              [self._row(d) for d in items_data])
+
+    def delete_items(self, idxs):
+        self.conn.executemany('DELETE FROM items WHERE idx = ?', [(idx,) for idx in idxs])
+
+    def load_items(self):
+        '''
+        Return: list of Item.data dicts
+        '''
+        items = []
+        for row in self.conn.execute('SELECT {}, extra FROM items'.format(', '.join(ITEM_COLUMNS))):
+            data = dict(zip(ITEM_COLUMNS, row[:-1]))
+            data['rel_path'] = bool(data['rel_path'])
+            if row[-1] is not None:
+                data.update(json.loads(row[-1]))
+            items.append(data)
+        return items
+
+    def count_items(self):
+        return self.conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    #### folders
+
+    def set_folders(self, folders):
+        self.conn.execute('DELETE FROM folders')
+        self.conn.executemany('INSERT INTO folders VALUES (?)', [(f,) for f in folders])
+
+    def load_folders(self):
+        return [row[0] for row in self.conn.execute('SELECT name FROM folders')]
+
+    #### checksum cache
+
+    def put_checksums(self, entries):
+        '''
+        Args:
+            entries: iterable of (path, size, mtime_ns, inode, checksum)
+        '''
+        self.conn.executemany('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)', entries)
+
+    def load_checksums(self):
+        return self.conn.execute('SELECT path, size, mtime_ns, inode, checksum FROM checksums').fetchall()
+
+    #### annotation summary cache
+
+    def put_summaries(self, entries):
+        '''
+        Args:
+            entries: iterable of (path, size, mtime_ns, summary)
+        '''
+        self.conn.executemany('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)',
+                              [(path, size, mtime_ns, json.dumps(summary)) for path, size, mtime_ns, summary in entries])
+
+    def load_summaries(self):
+        return [(path, size, mtime_ns, json.loads(summary)) for path, size, mtime_ns, summary in
+                self.conn.execute('SELECT path, size, mtime_ns, summary FROM summaries')]
+
+    #### project settings
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, json.dumps(value)))
+
+    def load_meta(self):
+        return {k: json.loads(v) for k, v in self.conn.execute('SELECT key, value FROM meta')}
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import threading
+import json
+import os
+
+from .enumDef import *
+from .annoBinary import write_binary
+
+def write_atomic(path, obj):
+    '''
+    write to a temporary file in the same directory, fsync and rename,
+    the file at path is either the old or the new version, never a partial one,
+    json or the binary container depending on the extension
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    if os.path.splitext(path)[1] == BINARY_ANNOTATION_EXT:
+        with open(tmp, 'wb') as f:
+            write_binary(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+    else:
+        with open(tmp, 'w') as f:
+            json.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class SaveQueue(object):
+
+    """
+    background writer of annotation files,
+    a file queued again before it was written is only written once, with the latest content
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()
+        self.callbacks = {}
+        self.writing = None
+        self.worker = None
+
+    def put(self, path, obj, on_written=None):
+        '''
+        Args:
+            path: destination file
+            obj: snapshot to be serialized, must not be modified afterwards
+            on_written: called from the worker thread after the file is written successfully
+        '''
+        with self.cond:
+            self.pending[path] = obj
+            if on_written is not None:
+                self.callbacks.setdefault(path, []).append(on_written)
+            self.cond.notify_all()
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+                path, obj = self.pending.popitem(last=False)
+                callbacks = self.callbacks.pop(path, [])
+                self.writing = path
+            try:
+                write_atomic(path, obj)
+                for callback in callbacks:
+                    callback()
+            except (OSError, TypeError, ValueError) as e:
+                print('WARN: Annotation Not Saved: ', path, e)
+            with self.cond:
+                self.writing = None
+                self.cond.notify_all()
+
+    def flush(self, path=None):
+        '''
+        block until the file (all files if path is None) is written
+        '''
+        with self.cond:
+            if path is None:
+                while len(self.pending) > 0 or self.writing is not None:
+                    self.cond.wait()
+            else:
+                while path in self.pending or self.writing == path:
+                    self.cond.wait()
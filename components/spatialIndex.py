@@ -0,0 +1,100 @@
+import math
+
+GRID_CELL_SIZE = 256
+
+class GridIndex(object):
+
+    """
+    uniform grid over bounding boxes (x0, y0, x1, y1),
+    every key is registered in all cells its box overlaps,
+    a point or rectangle query only visits the cells it touches
+    """
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.boxes = {}
+        # insertion order, later entries lie on top
+        self.order = {}
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, key):
+        return key in self.boxes
+
+    def clear(self):
+        self.cells.clear()
+        self.boxes.clear()
+        self.order.clear()
+        self.counter = 0
+
+    def _cells(self, box):
+        c = self.cell_size
+        col0, row0 = int(math.floor(box[0]/c)), int(math.floor(box[1]/c))
+        col1, row1 = int(math.floor(box[2]/c)), int(math.floor(box[3]/c))
+        for row in range(row0, row1+1):
+            for col in range(col0, col1+1):
+                yield (row, col)
+
+    def insert(self, key, box):
+        '''
+        Args:
+            key: hashable identifier
+            box: bounding box (x0, y0, x1, y1)
+        '''
+        if key in self.boxes:
+            self.remove(key)
+        box = tuple(box)
+        self.boxes[key] = box
+        self.order[key] = self.counter
+        self.counter += 1
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def update(self, key, box):
+        '''
+        move key to a new box, the stacking order is kept
+        '''
+        if key not in self.boxes:
+            self.insert(key, box)
+            return
+        order = self.order[key]
+        self.remove(key)
+        self.insert(key, box)
+        self.order[key] = order
+
+    def remove(self, key):
+        if key not in self.boxes:
+            return
+        box = self.boxes.pop(key)
+        del self.order[key]
+        for cell in self._cells(box):
+            keys = self.cells.get(cell)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.cells[cell]
+
+    def query_rect(self, box):
+        '''
+        Args:
+            box: query rectangle (x0, y0, x1, y1)
+        Return: list of keys whose boxes intersect the rectangle, topmost first
+        '''
+        found = set()
+        for cell in self._cells(box):
+            for key in self.cells.get(cell, ()):
+                if key in found:
+                    continue
+                b = self.boxes[key]
+                if b[0] <= box[2] and b[2] >= box[0] and b[1] <= box[3] and b[3] >= box[1]:
+                    found.add(key)
+        return sorted(found, key=self.order.get, reverse=True)
+
+    def query_point(self, x, y):
+        '''
+        Return: list of keys whose boxes contain (x, y), topmost first
+        '''
+        return self.query_rect((x, y, x, y))
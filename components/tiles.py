@@ -0,0 +1,136 @@
+from PyQt5.QtCore import QRectF
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from collections import OrderedDict
+import numpy as np
+import math
+import cv2
+
+TILE_SIZE = 512
+TILE_CACHE_SIZE = 256
+
+def pyramid_depth(height, width, tile_size=TILE_SIZE):
+    '''
+    Return: number of pyramid levels, level k is downsampled by 2**k, the last level fits into one tile
+    '''
+    depth = 1
+    while max(height, width) // 2**(depth-1) > tile_size:
+        depth += 1
+    return depth
+
+def pyramid_tile(data, level, row, col, tile_size=TILE_SIZE, convert=None):
+    '''
+    a tile of a pyramid level, downsampled from the part of the image it covers,
+    the levels themselves are never built
+    Args:
+        data: image array, gray (H, W) or rgb (H, W, 3)
+        convert: convert(tile) -> uint8 display values, applied to the tile only, None if data is uint8
+    Return: contiguous uint8 array of at most tile_size x tile_size
+    '''
+    s = 2**level
+    span = tile_size * s
+    tile = data[row*span:(row+1)*span, col*span:(col+1)*span]
+    if level > 0:
+        h, w = tile.shape[0], tile.shape[1]
+        tile = cv2.resize(tile, (max(1, w//s), max(1, h//s)), interpolation=cv2.INTER_AREA)
+    if convert is not None:
+        tile = convert(tile)
+    return np.ascontiguousarray(tile)
+
+
+class TiledImageItem(QGraphicsItem):
+
+    """
+    background layer for very large images,
+    only the tiles visible in the exposed area are converted to pixmaps,
+    taken from the pyramid level matching the current zoom,
+    tiles are downsampled from the image and converted to 8 bit when first painted,
+    neither a pyramid level nor an 8 bit copy of the image is kept in memory
+    """
+
+    def __init__(self, tile_size=TILE_SIZE, cache_size=TILE_CACHE_SIZE, parent=None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.data = None
+        self.convert = None
+        # identifies the displayed array, tiles are kept while it does not change
+        self.key = None
+        self.depth = 0
+        self.width, self.height = 0, 0
+        self.tiles = OrderedDict()
+
+    def is_active(self):
+        return self.data is not None
+
+    def set_image(self, data, key=None, convert=None):
+        '''
+        Args:
+            data: image array, gray (H, W) or rgb (H, W, 3)
+            key: identifies the displayed content, the cached tiles are kept if it is the current key (None never matches)
+            convert: convert(tile) -> uint8 display values, None if data is uint8
+        '''
+        if key is None or key != self.key or data.shape[:2] != (self.height, self.width):
+            self.tiles.clear()
+            self.update()
+        if data.shape[:2] != (self.height, self.width):
+            self.prepareGeometryChange()
+        self.data, self.key, self.convert = data, key, convert
+        self.height, self.width = data.shape[0], data.shape[1]
+        self.depth = pyramid_depth(self.height, self.width, self.tile_size)
+
+    def clear(self):
+        if self.is_active():
+            self.prepareGeometryChange()
+            self.data, self.key, self.convert = None, None, None
+            self.depth = 0
+            self.width, self.height = 0, 0
+            self.tiles.clear()
+            self.update()
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    def _level(self, lod):
+        # level k is used as long as one of its pixels covers at least one screen pixel
+        level = 0
+        while level + 1 < self.depth and lod * 2**(level+1) <= 1:
+            level += 1
+        return level
+
+    def _tile(self, level, row, col):
+        key = (level, row, col)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        tile = pyramid_tile(self.data, level, row, col, self.tile_size, self.convert)
+        h, w = tile.shape[0], tile.shape[1]
+        if len(tile.shape) == 2:
+            image = QImage(tile.data, w, h, tile.strides[0], QImage.Format_Grayscale8)
+        else:
+            image = QImage(tile.data, w, h, tile.strides[0], QImage.Format_RGB888)
+        pixmap = QPixmap.fromImage(image)
+        self.tiles[key] = pixmap
+        while len(self.tiles) > self.cache_size:
+            self.tiles.popitem(last=False)
+        return pixmap
+
+    def paint(self, painter, option, widget=None):
+        if not self.is_active():
+            return
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self._level(lod)
+        rect = option.exposedRect.intersected(self.boundingRect())
+        if rect.isEmpty():
+            return
+        # side of a tile in image pixels
+        span = self.tile_size * 2**level
+        col_start, col_end = int(rect.left())//span, min(int(math.ceil(rect.right()))//span, (self.width-1)//span)
+        row_start, row_end = int(rect.top())//span, min(int(math.ceil(rect.bottom()))//span, (self.height-1)//span)
+        for row in range(row_start, row_end+1):
+            for col in range(col_start, col_end+1):
+                pixmap = self._tile(level, row, col)
+                x, y = col*span, row*span
+                target = QRectF(x, y, min(span, self.width-x), min(span, self.height-y))
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
@@ -5,13 +5,14 @@ from PyQt5.QtCore import Qt, QTimer
 from PyQt5 import uic
 import cv2
 import os
-from pathlib import Path
 import time
 import sys
+from multiprocessing import freeze_support
 
 from components.config import Config
 from components.image import Image
 from components.project import Project
+from components.fileWalk import walk_files
 from components.labelManager import LabelManager
 from components.annotationManager import AnnotationManager
 from components.canvas import Canvas, View
@@ -122,6 +123,8 @@ class MainWindow(QMainWindow):
         self.actionProjectMerge.triggered.connect(self.project_merge)
         self.actionProjectSearch.triggered.connect(self.project_search_images)
         self.actionProjectReport.triggered.connect(self.project_report)
+        self.actionProjectBinaryAnnotation.triggered.connect(self.project_annotation_format)
+        self.actionProjectExport.triggered.connect(self.project_export)
 
         # annotation menu actions
         self.actionBrowse.triggered.connect(lambda :self.set_tool(BROWSE))
@@ -170,6 +173,7 @@ class MainWindow(QMainWindow):
         # signal between components
         self.labelDisp.signalLabelAssign.connect(self.canvas.assign_selected_items)
         self.labelDisp.signalDispChannelChanged.connect(self.canvas.sync_disp)
+        self.annotationMgr.on_labels_loaded = self.labelDisp.sync
         self.canvas.signalAnnotationSelected.connect(self.labelDisp.sync_annotationDisp)
         self.canvas.signalAnnotationReleased.connect(self.labelDisp.clear_annotationDisp)
 
@@ -209,8 +213,10 @@ class MainWindow(QMainWindow):
         Args:
             image: a QTreeWidgetItem or path string
         '''
-        # save annotation when necessary
-        self.annotationMgr.save()
+        # save annotation when necessary, written in the background
+        self.annotationMgr.save(block=False)
+        # livewire cost maps are cached in the project
+        self.canvas.livewire.cache.set_dir(self.project.cache_dir())
         # load image and annotation
         if self.project.is_open() and isinstance(image, ImageTreeItem):
             idx = image.idx
@@ -252,6 +258,7 @@ class MainWindow(QMainWindow):
 
     def hdf2json(self):
         self.annotationMgr.save()
+        self.annotationMgr.flush()
         if self.project.is_open():
             self.project.save()
             progress = ProgressDiag(len(self.project.index_id), 'Converting hdf5 to json ...')
@@ -284,7 +291,7 @@ class MainWindow(QMainWindow):
         if not filename:
             project_dialog = QFileDialog(self, "Select Project Directory")
             project_dialog.setLabelText(QFileDialog.Accept, 'Create/Open')
-            project_dialog.setNameFilter("*.improj")
+            project_dialog.setNameFilter("Project (*.imdb *.improj)")
             project_dialog.setLabelText(QFileDialog.FileName, 'Project Name')
 
             if project_dialog.exec_() == QFileDialog.Accepted:
@@ -297,6 +304,7 @@ class MainWindow(QMainWindow):
             if self.project.is_open():
                 self.fileList.init_list(self.project.index_id.keys(), mode='project')
                 self.fileList.enableBtn()
+                self.actionProjectBinaryAnnotation.setChecked(self.project.annotation_format() == 'binary')
                 self.sync_statusBar()
                 self.config['fileDirectory'] = self.project.proj_dir
     
@@ -332,12 +340,15 @@ class MainWindow(QMainWindow):
                 self.fileList.close_project()
         folder = QFileDialog.getExistingDirectory(self, 'Select Directory')
         if len(folder) != 0:
-            files = [str(path) for t in IMAGE_TYPES for path in Path(folder).rglob(t)]
+            files = walk_files(folder, exclude=self.config['ScanExclude'], max_depth=self.config['ScanMaxDepth'])
             if self.project.is_open():
+                # images are imported batch by batch while the folder is walked
                 f = self.fileList.get_selected_folder()
                 idxs = self.project.add_images(files, f)
                 self.fileList.add_list(idxs, mode='project')
             else:
+                # the file list is sorted, it needs all files
+                files = list(files)
                 status = [os.path.splitext(f)[0] + ANNOTATION_EXT for f in files]
                 status = [self.annotationMgr.get_status(s) for s in status] 
                 self.fileList.init_list(files, status, mode='file')
@@ -348,11 +359,12 @@ class MainWindow(QMainWindow):
     def project_search_images(self):
         if self.project.is_open():
             folder = QFileDialog.getExistingDirectory(self, 'Select Directory')
-            self.project.search_image(folder)
+            self.project.search_image(folder, exclude=self.config['ScanExclude'], max_depth=self.config['ScanMaxDepth'])
             self.fileList.init_list(self.project.index_id.keys(), mode='project')
     
     def project_remove_duplicate(self):
         if self.project.is_open():
+            self.annotationMgr.flush()
             self.project.remove_duplicate()
             self.fileList.init_list(self.project.index_id.keys(), mode='project')
 
@@ -361,6 +373,7 @@ class MainWindow(QMainWindow):
         # save project
         self.project.save()
         self.annotationMgr.save()
+        self.annotationMgr.flush()
         # run project merger
         projectMerger = ProjectMerger(self.config)
         projectMerger.projectMerged.connect(self._fileList_refresh)
@@ -373,6 +386,7 @@ class MainWindow(QMainWindow):
         # save project
         self.project.save()
         self.annotationMgr.save()
+        self.annotationMgr.flush()
         # run collect/distribute
         distributor = AnnotationDistributor(self.config)
         distributor.projectMerged.connect(self._fileList_refresh)
@@ -390,12 +404,31 @@ class MainWindow(QMainWindow):
             # save project
             self.project.save()
             self.annotationMgr.save()
+            self.annotationMgr.flush()
             # counting 
             report = ProjectReport(self.config)
             report.init_table(self.project)
             report.exec()
             del report
 
+    def project_export(self):
+        if self.project.is_open():
+            self.project.save()
+            self.project.export_improj(path=None)
+
+    def project_annotation_format(self, binary):
+        if not self.project.is_open():
+            self.actionProjectBinaryAnnotation.setChecked(False)
+            return
+        # the current annotation file is converted as well
+        self.annotationMgr.save()
+        self.annotationMgr.close()
+        self.annotationMgr.flush()
+        self.project.set_annotation_format('binary' if binary else 'json')
+        item = self.fileList.fileList.currentItem()
+        if isinstance(item, ImageTreeItem):
+            self.load(item)
+
     def project_close(self):
         self.fileList.close_project()
 
@@ -405,6 +438,7 @@ class MainWindow(QMainWindow):
         self.sync_statusBar()
 
     def export_annotation(self):
+        self.annotationMgr.flush()
         annoExporter = AnnoExporter(self.config, self.project)
         annoExporter.initial_list(self.fileList)
         annoExporter.exec()
@@ -544,13 +578,15 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         self.annotationMgr.save()
+        self.annotationMgr.flush()
         self.project.save()
         self.config.save()
         super().closeEvent(event)
         
 
 if __name__ == "__main__":
-    # freeze_support()
+    # the export process pool relaunches this script in frozen (PyInstaller) builds
+    freeze_support()
 
     QApplication.setStyle("Fusion")
     #
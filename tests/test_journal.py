@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication, QMessageBox
+
+from components.config import Config
+from components.labelManager import LabelManager
+from components.annotationManager import AnnotationManager
+from components.enumDef import *
+
+APP = QApplication.instance() or QApplication([])
+
+
+class CompactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'anno' + ANNOTATION_EXT)
+        with open(self.path, 'w') as f:
+            json.dump({'status': UNFINISHED, 'labels': {}, 'annotations': {}}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _manager(self):
+        config = Config(os.path.join(self.dir, 'config', 'config.json'))
+        annotationMgr = AnnotationManager(config, LabelManager(config))
+        annotationMgr.load(self.path)
+        return config, annotationMgr
+
+    def _edit(self, annotationMgr):
+        # more edits than the compaction limit
+        for i in range(annotationMgr.config['JournalCompactOps'] + 50):
+            annotationMgr.new_annotation({'timestamp': 't{}'.format(i), 'type': DOT, 'labels': {}, 'coords': [i, i]})
+        annotationMgr.flush()
+
+    def _saved_annotations(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)['annotations']
+
+    def test_compacted_edits_are_discarded(self):
+        config, annotationMgr = self._manager()
+        self._edit(annotationMgr)
+        self.assertFalse(config.saved)
+        with mock.patch('components.annotationManager.QMessageBox.question', return_value=QMessageBox.No):
+            annotationMgr.save(inquiry=True)
+        annotationMgr.flush()
+        self.assertEqual(self._saved_annotations(), {})
+        _, annotationMgr = self._manager()
+        self.assertEqual(len(list(annotationMgr.keys())), 0)
+
+    def test_compacted_edits_are_recovered_and_saved(self):
+        config, annotationMgr = self._manager()
+        self._edit(annotationMgr)
+        # reopened without saving, as after a crash
+        config, annotationMgr = self._manager()
+        self.assertFalse(config.saved)
+        self.assertEqual(len(list(annotationMgr.keys())), config['JournalCompactOps'] + 50)
+        with mock.patch('components.annotationManager.QMessageBox.question', return_value=QMessageBox.Yes):
+            annotationMgr.save(inquiry=True)
+        annotationMgr.flush()
+        self.assertEqual(len(self._saved_annotations()), config['JournalCompactOps'] + 50)
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted(['anno' + ANNOTATION_EXT, 'config']))
+
+
+if __name__ == '__main__':
+    unittest.main()